@@ -0,0 +1,232 @@
+'''
+batch reaction prediction
+
+predict_many scores a whole list of reactant sets, sharing the memoized
+filter, thermo index and balancing caches in alchemist.tools across the
+batch and spreading the work over a pool of processes. results come back as
+they complete.
+
+command line:
+    python -m alchemist.batch reactions.jsonl -o predictions.jsonl
+    python -m alchemist.batch reactions.jsonl --screen screened.parquet
+
+input is JSONL (one list of formulas, or an object with a 'reactants' list,
+per line) or CSV (one reactant set per row, one formula per cell). output is
+JSONL with one record per reactant set, written as soon as it is ready.
+with --screen, every balanced candidate of every reactant set is scored
+instead (see tools.screen_reactions) and written as one CSV or Parquet
+table; sets with no balanced reaction, or that failed, keep one row, with
+the failure in its error column.
+'''
+
+import sys
+import csv
+import json
+import argparse
+import multiprocessing
+
+from alchemist import tools
+
+
+def predict_one(reactants, max_length=12, deadline_ms=None, cache=True):
+    '''
+    Runs reaction_predictor on one reactant set and returns a JSON-friendly
+    record instead of raising.
+
+    --Parameters--
+    reactants:      iterable (str)
+        any iterable containing strings with valid chemical formulas
+
+    --Output--
+    dict
+        reactants, reaction (str or None), energy, exhaustive, error
+
+    --Examples--
+    >>> predict_one(['Al', 'O2'])['reaction']
+    '4 Al(s) + 3 O2(g) -> 2 Al2O3(s)'
+    '''
+    record = {'reactants': list(reactants), 'reaction': None, 'energy': None,
+              'exhaustive': None, 'error': None}
+    try:
+        prediction = tools.reaction_predictor(
+            reactants, max_length=max_length, cache=cache,
+            deadline_ms=deadline_ms, full_output=True)
+        if prediction.reaction is not None:
+            record['reaction'] = str(prediction.reaction)
+            record['energy'] = float(prediction.energy)
+        record['exhaustive'] = prediction.exhaustive
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    return record
+
+
+def _predict_indexed(args):
+    i, reactants, kwargs = args
+    return i, predict_one(reactants, **kwargs)
+
+
+def predict_many(reactant_sets, max_length=12, deadline_ms=None, cache=True,
+                 processes=None, chunksize=4):
+    '''
+    Predicts the reaction for every reactant set, yielding results in the
+    order they complete.
+
+    --Parameters--
+    reactant_sets:  iterable (iterable (str))
+    processes:      int or None
+        worker processes; None uses every core and 1 runs in this process
+
+    --Output--
+    generator (tuple)
+        (index into reactant_sets, record from predict_one)
+
+    --Examples--
+    >>> sorted(predict_many([['Al', 'O2'], ['Na', 'H2O']]))[1][1]['reaction']
+    '2 Na(s) + 2 H2O(l) -> 2 NaOH(aq) + H2(g)'
+    '''
+    kwargs = {'max_length': max_length, 'deadline_ms': deadline_ms,
+              'cache': cache}
+    tasks = ((i, list(r), kwargs) for i, r in enumerate(reactant_sets))
+    if processes == 1:
+        for task in tasks:
+            yield _predict_indexed(task)
+        return
+    # load the tables and build their indexes before forking, so that the
+    # workers share them copy-on-write rather than each loading its own
+    tools.preload()
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(
+                _predict_indexed, tasks, chunksize=chunksize):
+            yield result
+
+
+def screen_one(reactants, max_length=12, T=None):
+    '''
+    Runs screen_reactions on one reactant set and records a failure instead
+    of raising, as predict_one does.
+
+    --Output--
+    DataFrame
+        screen_reactions columns, with reactants (joined by ' + ') first and
+        error last; a set with no balanced reaction gives one row with only
+        reactants filled in, a set that fails one row with its error
+    '''
+    import pandas as pd
+    error = None
+    try:
+        table = tools.screen_reactions(reactants, max_length=max_length, T=T)
+    except Exception as e:
+        table = pd.DataFrame(columns=tools.SCREEN_COLUMNS)
+        error = f'{type(e).__name__}: {e}'
+    if table.empty:
+        # keep the set in the output, with NaN for the missing results
+        table = table.reindex([0])
+    table.insert(0, 'reactants', ' + '.join(reactants))
+    table['error'] = error
+    return table
+
+
+def _screen_indexed(args):
+    i, reactants, kwargs = args
+    return i, screen_one(reactants, **kwargs)
+
+
+def screen_many(reactant_sets, max_length=12, T=None, processes=None,
+                chunksize=4):
+    '''
+    Screens every reactant set and stacks the tables, in input order.
+
+    --Output--
+    DataFrame
+        screen_one's columns, with index (into reactant_sets) first
+    '''
+    import pandas as pd
+    kwargs = {'max_length': max_length, 'T': T}
+    tasks = [(i, list(r), kwargs) for i, r in enumerate(reactant_sets)]
+    if processes == 1:
+        results = [_screen_indexed(task) for task in tasks]
+    else:
+        # as in predict_many, the workers inherit the loaded tables
+        tools.preload()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_screen_indexed, tasks, chunksize=chunksize)
+    tables = []
+    for i, table in results:
+        table.insert(0, 'index', i)
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_table(table, path):
+    '''
+    Writes a DataFrame as Parquet if path ends in .parquet (needs pyarrow or
+    fastparquet), as CSV otherwise.
+    '''
+    if path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+def read_reactant_sets(path):
+    '''
+    Reads reactant sets from a JSONL or CSV file ('-' reads JSONL from stdin).
+
+    --Output--
+    generator (list (str))
+    '''
+    fh = sys.stdin if path == '-' else open(path, newline='')
+    with fh:
+        if path.endswith('.csv'):
+            for row in csv.reader(fh):
+                row = [cell.strip() for cell in row if cell.strip()]
+                if row:
+                    yield row
+        else:
+            for line in fh:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if isinstance(entry, dict):
+                    entry = entry['reactants']
+                yield entry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='predict the products of many reactant sets')
+    parser.add_argument('input', help='JSONL or CSV file of reactant sets')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSONL file to write (default: stdout)')
+    parser.add_argument('-p', '--processes', type=int, default=None)
+    parser.add_argument('--max-length', type=int, default=12)
+    parser.add_argument('--deadline-ms', type=float, default=None)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--screen', default=None,
+                        help='write every balanced candidate, with delG, '
+                             'delH, delS and log K, to this CSV or Parquet '
+                             'file instead')
+    parser.add_argument('-T', type=float, default=None,
+                        help='temperature in K for --screen')
+    args = parser.parse_args(argv)
+
+    if args.screen:
+        write_table(screen_many(read_reactant_sets(args.input),
+                                max_length=args.max_length, T=args.T,
+                                processes=args.processes), args.screen)
+        return
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    with out:
+        for i, record in predict_many(
+                read_reactant_sets(args.input),
+                max_length=args.max_length, deadline_ms=args.deadline_ms,
+                cache=not args.no_cache, processes=args.processes):
+            out.write(json.dumps({'index': i, **record}) + '\n')
+            out.flush()
+
+
+if __name__ == '__main__':
+    main()
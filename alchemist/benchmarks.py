@@ -0,0 +1,291 @@
+'''
+benchmarks for the alchemist.tools hot paths
+
+every case runs against the synthetic fixture and, when the processed pickles
+are present, against the real tables too. each case reports latency
+percentiles, how many times each tools function was called, and peak memory.
+results can be saved as a baseline JSON and later runs compared against it.
+the import of each IMPORT_CASES module is timed too, in fresh interpreters.
+
+command line:
+    python -m alchemist.benchmarks --save baseline.json
+    python -m alchemist.benchmarks --baseline baseline.json
+    python -m alchemist.benchmarks --imports-only
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from alchemist import tools
+from alchemist.fixtures import synthetic_tables
+
+# function name, args, kwargs
+CASES = [
+    ('get_gibbs', ('NaCl(aq)',), {}),
+    ('get_gibbs', ('H2O',), {}),
+    ('get_gibbs', ('Al2O3(s)', 'mass'), {}),
+    ('state_predictor', ('CO2',), {}),
+    ('state_predictor', ('H2O',), {}),
+    ('stoich_filter', ('CO2(g)',), {}),
+    ('stoich_filter', (['Al', 'O2'],), {}),
+    ('stoich_filter', ('CO2(g)',), {'exact': True}),
+    ('check_coefficients', (['CH4', 'H2O'], ['CO', 'H2']), {}),
+    ('check_coefficients', (['CH4', 'H2O'], ['CO2', 'H2O2']), {}),
+    ('standard_gibbs_free_energy', (['Na', 'H2O'], ['NaH', 'O2']), {}),
+    ('reaction_predictor', (['Al', 'O2'],), {'cache': False}),
+    ('reaction_predictor', (['CH4', 'H2O'],), {'cache': False}),
+    ('reaction_predictor', (['Na', 'H2O'],), {'cache': False}),
+]
+
+# element-rich inputs; these dominate a run against the real tables
+STRESS_CASES = [
+    ('reaction_predictor', (['Na', 'H2O', 'CO2'],), {'cache': False}),
+    ('reaction_predictor', (['Al', 'NaOH', 'H2O'],), {'cache': False}),
+    ('reaction_predictor', (['Na', 'HCl', 'CO2'],), {'cache': False}),
+    ('reaction_predictor', (['Ba', 'S', 'O2'],), {'cache': False}),
+]
+
+# modules whose import time is measured; CLI tools and short-lived workers
+# pay for these on every start
+IMPORT_CASES = ['alchemist.tools', 'alchemist.batch', 'alchemist.periodic']
+
+# functions whose calls are counted while a case runs
+COUNTED = ['get_gibbs', 'state_predictor', 'stoich_filter',
+           'check_coefficients', 'standard_gibbs_free_energy', 'Z_unique',
+           'formula_state_separator', '_balance', '_coefficients']
+
+
+def case_name(name, args, kwargs):
+    '''
+    --Examples--
+    >>> case_name('stoich_filter', ('CO2(g)',), {'exact': True})
+    "stoich_filter('CO2(g)', exact=True)"
+    '''
+    params = [repr(a) for a in args] + [f'{k}={v!r}' for k, v in kwargs.items()]
+    return f"{name}({', '.join(params)})"
+
+
+def count_calls(fn):
+    '''
+    Runs fn once with the COUNTED tools functions wrapped, and returns how
+    many times each of them was called.
+    '''
+    counts = dict.fromkeys(COUNTED, 0)
+    originals = {name: getattr(tools, name) for name in COUNTED}
+
+    def counting(name, f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return f(*args, **kwargs)
+        return wrapper
+
+    for name, f in originals.items():
+        setattr(tools, name, counting(name, f))
+    try:
+        fn()
+    finally:
+        for name, f in originals.items():
+            setattr(tools, name, f)
+    return {name: n for name, n in counts.items() if n}
+
+
+def run_case(name, args, kwargs, repeat=10, warm=False):
+    '''
+    Times one case. Memoized lookups are cleared before every call unless
+    warm is True.
+
+    --Output--
+    dict
+        calls, p50_ms, p90_ms, p99_ms, mean_ms, peak_kb, counts
+    '''
+    fn = functools.partial(getattr(tools, name), *args, **kwargs)
+    if warm:
+        fn()
+    times = []
+    for _ in range(repeat):
+        if not warm:
+            tools.clear_caches()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    if not warm:
+        tools.clear_caches()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    if not warm:
+        tools.clear_caches()
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {'calls': repeat, 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99,
+            'mean_ms': float(np.mean(times)), 'peak_kb': peak / 1024,
+            'counts': count_calls(fn)}
+
+
+def import_time(module, repeat=5):
+    '''
+    Times `import module` in fresh interpreters.
+
+    --Output--
+    dict
+        calls, p50_ms, p90_ms, p99_ms, mean_ms, slowest (the five slowest
+        imported modules by cumulative microseconds, from -X importtime)
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+        times.append((time.perf_counter() - start) * 1000)
+
+    report = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        check=True, capture_output=True, text=True).stderr
+    cumulative = {}
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cum, name = line.split('|')
+        cumulative[name.strip()] = int(cum)
+    slowest = sorted((n for n in cumulative if n != module),
+                     key=cumulative.get, reverse=True)[:5]
+
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {'calls': repeat, 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99,
+            'mean_ms': float(np.mean(times)),
+            'slowest': {n: cumulative[n] for n in slowest}}
+
+
+def run_imports(repeat=5, out=sys.stdout):
+    '''
+    Times the import of every IMPORT_CASES module.
+
+    --Output--
+    dict
+        {'import <module>': result from import_time}
+    '''
+    results = {}
+    for module in IMPORT_CASES:
+        key = f'import {module}'
+        results[key] = r = import_time(module, repeat)
+        print(f"{key:<70} p50 {r['p50_ms']:9.3f} ms  "
+              f"p99 {r['p99_ms']:9.3f} ms", file=out)
+    return results
+
+
+def datasets():
+    '''
+    Yields (label, stoich_df, thermo_df): the fixture, then the real tables
+    if the processed pickles exist.
+    '''
+    yield ('fixture', *synthetic_tables())
+    if all(os.path.exists(os.path.join(tools.DATA_DIR, f))
+           for f in tools.DATA_FILES):
+        tools.load_data()
+        yield 'real', tools.STOICH_DF, tools.THERMO_DF
+
+
+def run(repeat=10, warm=False, stress=True, only=None, out=sys.stdout):
+    '''
+    Runs every case against every dataset.
+
+    --Parameters--
+    only:           str or None
+        run just the cases for this tools function
+
+    --Output--
+    dict
+        {'<dataset>: <case>': result from run_case}
+    '''
+    cases = CASES + (STRESS_CASES if stress else [])
+    if only is not None:
+        cases = [c for c in cases if c[0] == only]
+    results = {}
+    for label, stoich_df, thermo_df in datasets():
+        tools.use_tables(stoich_df, thermo_df)
+        for name, args, kwargs in cases:
+            key = f'{label}: {case_name(name, args, kwargs)}'
+            try:
+                results[key] = run_case(name, args, kwargs, repeat, warm)
+            except Exception as e:
+                print(f'{key:<70} failed: {type(e).__name__}: {e}', file=out)
+                continue
+            r = results[key]
+            print(f"{key:<70} p50 {r['p50_ms']:9.3f} ms  "
+                  f"p99 {r['p99_ms']:9.3f} ms  peak {r['peak_kb']:9.1f} kB",
+                  file=out)
+    return results
+
+
+def compare(results, baseline, threshold=1.25):
+    '''
+    Compares median latencies against a baseline.
+
+    --Parameters--
+    threshold:      float
+        slowdown ratio beyond which a case counts as a regression
+
+    --Output--
+    list (tuple)
+        (case, baseline p50, current p50, ratio) for every regression
+    '''
+    regressions = []
+    for key, r in results.items():
+        if key not in baseline:
+            continue
+        ratio = r['p50_ms'] / max(baseline[key]['p50_ms'], 1e-9)
+        if ratio > threshold:
+            regressions.append(
+                (key, baseline[key]['p50_ms'], r['p50_ms'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark the alchemist.tools hot paths')
+    parser.add_argument('-n', '--repeat', type=int, default=10)
+    parser.add_argument('--warm', action='store_true',
+                        help='keep memoized lookups between calls')
+    parser.add_argument('--no-stress', action='store_true',
+                        help='skip the element-rich reaction_predictor cases')
+    parser.add_argument('--only', help='benchmark one tools function')
+    parser.add_argument('--no-imports', action='store_true',
+                        help='skip the import-time cases')
+    parser.add_argument('--imports-only', action='store_true',
+                        help='run just the import-time cases')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    results = {}
+    if not args.no_imports:
+        results.update(run_imports())
+    if not args.imports_only:
+        results.update(
+            run(args.repeat, args.warm, not args.no_stress, args.only))
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.threshold)
+        for key, before, after, ratio in regressions:
+            print(f'REGRESSION {key}: {before:.3f} -> {after:.3f} ms '
+                  f'({ratio:.2f}x)')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+'''
+persistent cache for reaction predictions
+
+results live in a small in-process LRU, backed by an on-disk SQLite table so
+they survive restarts. keys are built from the state-normalized reactants,
+max_length and the data version, so a rebuilt thermo table never serves stale
+answers.
+
+ReactionNetwork is the read side of the precomputed per-element-system table
+that alchemist.network builds.
+'''
+
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def prediction_key(reactants, max_length, version, T=None):
+    '''
+    Builds the cache key for a reaction prediction.
+
+    --Parameters--
+    reactants:      iterable (str)
+        state-normalized formulas, e.g. the output of state_predictor
+    max_length:     int
+    version:        str
+        data version hash of the thermo/stoich tables
+    T:              float or None
+        temperature in K; None (standard state) leaves the key unchanged
+
+    --Output--
+    str
+
+    --Examples--
+    >>> prediction_key(['O2(g)', 'Al(s)'], 12, 'abc123')
+    'abc123|12|Al(s)+O2(g)'
+
+    >>> prediction_key(['O2(g)', 'Al(s)'], 12, 'abc123', T=500)
+    'abc123|12|Al(s)+O2(g)|T=500.0'
+    '''
+    key = f"{version}|{max_length}|{'+'.join(sorted(reactants))}"
+    if T is not None:
+        key += f'|T={float(T)}'
+    return key
+
+
+def encode_prediction(reaction, energy):
+    '''
+    Serializes a (Reaction, delG) pair to JSON.
+    '''
+    # chempy keeps coefficients as sympy integers; store them as plain ints
+    return json.dumps({
+        'reac': {k: int(v) for k, v in reaction.reac.items()},
+        'prod': {k: int(v) for k, v in reaction.prod.items()},
+        'energy': float(energy),
+    })
+
+
+def decode_prediction(value):
+    '''
+    Inverse of encode_prediction; returns a (Reaction, delG) pair.
+    '''
+    from chempy import Reaction
+    value = json.loads(value)
+    return Reaction(value['reac'], value['prod']), value['energy']
+
+
+class PredictionCache:
+    '''
+    LRU of (Reaction, delG) pairs in front of an optional SQLite store.
+
+    --Parameters--
+    path:           str or None
+        location of the SQLite file; None keeps the cache in memory only
+    version:        str
+        data version; rows written under any other version (and not kept by
+        set_version) are purged
+    maxsize:        int
+        number of entries kept in memory
+    '''
+
+    def __init__(self, path=None, version='', maxsize=1024):
+        self.path = path
+        self.version = version
+        self.keep = frozenset()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        # opened lazily so importing alchemist never touches the disk, and
+        # skipped when there is no data directory to keep it in
+        if self._db is None and self.path is not None and \
+                os.path.isdir(os.path.dirname(self.path) or '.'):
+            self._db = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS predictions '
+                '(key TEXT PRIMARY KEY, version TEXT, value TEXT)')
+            self._purge()
+        return self._db
+
+    def get(self, key):
+        '''
+        Returns the cached (Reaction, delG) pair for key, or None.
+        '''
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            db = self._connect()
+            row = None
+            if db is not None:
+                row = db.execute(
+                    'SELECT value FROM predictions WHERE key = ?',
+                    (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            result = decode_prediction(row[0])
+            self._remember(key, result)
+            return result
+
+    def set(self, key, reaction, energy, version=None):
+        '''
+        Stores a prediction in memory and, if configured, on disk.
+
+        --Parameters--
+        version:        str or None
+            data version the prediction was made from, which can differ
+            from self.version when the tables were swapped mid-search; None
+            means self.version
+        '''
+        with self._lock:
+            version = self.version if version is None else version
+            self._remember(key, (reaction, float(energy)))
+            db = self._connect()
+            if db is not None:
+                db.execute(
+                    'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                    (key, version, encode_prediction(reaction, energy)))
+                db.commit()
+
+    def clear(self):
+        '''
+        Drops every cached prediction, in memory and on disk.
+        '''
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute('DELETE FROM predictions')
+                db.commit()
+
+    def set_version(self, version, keep=()):
+        '''
+        Switches to a new data version, dropping entries from versions
+        nobody uses any more. Does nothing if version is already current.
+
+        --Parameters--
+        keep:           iterable (str)
+            other versions still in use, e.g. of contexts passed explicitly;
+            their entries are kept
+        '''
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self.keep = frozenset(keep) - {version}
+            live = self.keep | {version}
+            # keys start with their version; see prediction_key
+            for key in [k for k in self._memory
+                        if k.split('|', 1)[0] not in live]:
+                del self._memory[key]
+            if self._db is not None:
+                self._purge()
+
+    def after_fork(self):
+        '''
+        Drops a SQLite connection inherited from a parent process; the child
+        opens its own on next use.
+        '''
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _purge(self):
+        # deletes the rows of every version but the current and kept ones
+        live = sorted(self.keep | {self.version})
+        self._db.execute(
+            'DELETE FROM predictions WHERE version NOT IN '
+            f"({', '.join('?' * len(live))})", live)
+        self._db.commit()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+
+def elements_key(elements):
+    '''
+    --Examples--
+    >>> elements_key({8, 13})
+    '8-13'
+    '''
+    return '-'.join(str(z) for z in sorted(elements))
+
+
+def reactants_key(reactants):
+    '''
+    --Examples--
+    >>> reactants_key(['O2(g)', 'Al(s)'])
+    'Al(s)+O2(g)'
+    '''
+    return '+'.join(sorted(reactants))
+
+
+class ReactionNetwork:
+    '''
+    Read/write access to a table of precomputed predictions.
+
+    --Parameters--
+    path:           str
+        location of the SQLite file; a missing file is an empty network
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self, create=False):
+        if self._db is None and (create or os.path.exists(self.path)):
+            self._db = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS reactions '
+                '(elements TEXT, reactants TEXT, max_length INTEGER, '
+                'version TEXT, value TEXT, energy REAL, '
+                'PRIMARY KEY (elements, reactants, max_length, version))')
+            self._db.commit()
+        return self._db
+
+    def lookup(self, reactants, elements, max_length, version):
+        '''
+        Returns the stored (Reaction, delG) pair for state-normalized
+        reactants, or None if the network doesn't cover them.
+        '''
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return None
+            row = db.execute(
+                'SELECT value FROM reactions WHERE elements = ? AND '
+                'reactants = ? AND max_length = ? AND version = ?',
+                (elements_key(elements), reactants_key(reactants),
+                 max_length, version)).fetchone()
+        return None if row is None else decode_prediction(row[0])
+
+    def system(self, elements, version):
+        '''
+        Returns every stored reaction for an element system.
+
+        --Output--
+        list (tuple)
+            (reactants key, max_length, Reaction, delG)
+        '''
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return []
+            rows = db.execute(
+                'SELECT reactants, max_length, value FROM reactions '
+                'WHERE elements = ? AND version = ?',
+                (elements_key(elements), version)).fetchall()
+        return [(r, m, *decode_prediction(v)) for r, m, v in rows]
+
+    def add(self, reactants, elements, max_length, version, reaction,
+            energy):
+        with self._lock:
+            self._connect(create=True).execute(
+                'INSERT OR REPLACE INTO reactions VALUES (?, ?, ?, ?, ?, ?)',
+                (elements_key(elements), reactants_key(reactants),
+                 max_length, version, encode_prediction(reaction, energy),
+                 float(energy)))
+
+    def commit(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+
+    def prune(self, version):
+        '''
+        Deletes reactions computed against any other data version.
+        '''
+        with self._lock:
+            db = self._connect()
+            if db is not None:
+                db.execute('DELETE FROM reactions WHERE version != ?',
+                           (version,))
+                db.commit()
+
+    def after_fork(self):
+        self._db = None
+        self._lock = threading.Lock()
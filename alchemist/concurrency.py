@@ -0,0 +1,127 @@
+'''
+concurrency stress check for alchemist.tools
+
+fires the same predictions from many threads at once and checks every answer
+against a single-threaded reference run. meanwhile another thread keeps
+swapping equivalent contexts in with use_context, each starting with no
+memoized lookups, so requests race both each other and a data reload. half
+of the requests pass their context explicitly, the other half use the
+current one.
+
+runs against the synthetic fixture, or the processed pickles with --real.
+
+command line:
+    python -m alchemist.concurrency --threads 16 --rounds 20
+    python -m alchemist.concurrency --real
+'''
+
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from alchemist import tools
+from alchemist.fixtures import synthetic_tables
+
+REACTANT_SETS = [['Al', 'O2'], ['Na', 'H2O'], ['CH4', 'H2O'], ['H2', 'O2'],
+                 ['Na', 'Cl2'], ['C', 'O2'], ['NaOH', 'HCl'], ['Al', 'HCl'],
+                 ['Na', 'H2O', 'CO2'], ['Ba', 'S', 'O2']]
+
+
+def predict(reactants, context=None):
+    '''
+    --Output--
+    tuple
+        (reaction as text, delG) or (error type, message); what two runs
+        must agree on
+    '''
+    try:
+        prediction = tools.reaction_predictor(
+            reactants, cache=False, full_output=True, context=context)
+    except Exception as e:
+        return type(e).__name__, str(e)
+    return str(prediction.reaction), prediction.energy
+
+
+def stress(context, reactant_sets=REACTANT_SETS, threads=8, rounds=10,
+           swap=True, out=sys.stdout):
+    '''
+    Runs every reactant set rounds times over a pool of threads.
+
+    --Parameters--
+    context:        tools.Context
+    swap:           bool
+        keep re-installing copies of context while the requests run
+
+    --Output--
+    list (tuple)
+        (reactants, expected, got) for every answer that differs from the
+        single-threaded one
+    '''
+    tools.use_context(context)
+    expected = {tuple(r): predict(r, context) for r in reactant_sets}
+
+    done = threading.Event()
+    swaps = 0
+
+    def swapper():
+        nonlocal swaps
+        while not done.is_set():
+            tools.use_context(tools.Context(
+                context.stoich_df, context.thermo_df, context.version))
+            swaps += 1
+            time.sleep(0.01)
+
+    tools.clear_caches()
+    tasks = [(r, i % 2 == 0) for i in range(rounds) for r in reactant_sets]
+    if swap:
+        thread = threading.Thread(target=swapper, daemon=True)
+        thread.start()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(
+                lambda task: predict(task[0], context if task[1] else None),
+                tasks))
+    finally:
+        done.set()
+        if swap:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    mismatches = [(reactants, expected[tuple(reactants)], got)
+                  for (reactants, _), got in zip(tasks, results)
+                  if got != expected[tuple(reactants)]]
+    print(f'{len(tasks)} predictions on {threads} threads in '
+          f'{elapsed:.2f} s, {swaps} context swaps, '
+          f'{len(mismatches)} mismatches', file=out)
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='check that concurrent predictions are deterministic')
+    parser.add_argument('-t', '--threads', type=int, default=8)
+    parser.add_argument('-r', '--rounds', type=int, default=10)
+    parser.add_argument('--no-swap', action='store_true',
+                        help='keep one context for the whole run')
+    parser.add_argument('--real', action='store_true',
+                        help='use the processed pickles instead of the '
+                             'synthetic fixture')
+    args = parser.parse_args(argv)
+
+    if args.real:
+        context = tools.current_context()
+    else:
+        context = tools.Context(*synthetic_tables())
+    mismatches = stress(context, threads=args.threads, rounds=args.rounds,
+                        swap=not args.no_swap)
+    for reactants, expected, got in mismatches:
+        print(f'MISMATCH {reactants}: expected {expected}, got {got}')
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
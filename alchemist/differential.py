@@ -0,0 +1,381 @@
+'''
+differential checks of the alchemist.tools fast paths against the original
+implementations
+
+alchemist.tools answers from indexes, caches and batched matrix products; the
+functions below are the pandas/sympy versions they replaced, kept as they
+were first written apart from taking the tables from a context. run samples
+random species, substance sets and candidate equations from the thermo/stoich
+tables, feeds each sample to both, reports every disagreement and times both
+sides, so equivalence and speed are measured on the same inputs.
+
+checked: get_gibbs (indexed lookup), state_predictor, stoich_filter (element
+index and composition matrix), check_coefficients and the balanced
+coefficients (memoized balancer), and delG (the search's batched
+_candidate_matrix scoring against standard_gibbs_free_energy per equation).
+substance sets include ions.
+
+command line:
+    python -m alchemist.differential --samples 200 --seed 1
+    python -m alchemist.differential --real --save differential.json
+'''
+
+import sys
+import json
+import time
+import random
+import argparse
+import functools
+
+import numpy as np
+
+from alchemist import tools
+from alchemist.fixtures import synthetic_tables
+
+CHECKS = ['get_gibbs', 'state_predictor', 'stoich_filter',
+          'check_coefficients', 'delG']
+# relative tolerance for energies; batching only reorders the sums
+RTOL = 1e-9
+
+
+# reference implementations
+
+def reference_get_gibbs(context, formula, energy='G', df=False):
+    thermo_df = context.thermo_df
+    if (thermo_df['formula'] == formula).max():
+        matches = thermo_df[thermo_df['formula'] == formula]
+    else:
+        matches = thermo_df[thermo_df['formula'].map(
+            lambda x: x[:len(formula)] == formula)]
+        matches = matches[matches['formula'].map(
+            tools.formula_state_separator) == formula]
+    if df:
+        return matches
+    return list(matches[energy])[0]
+
+
+def reference_state_predictor(context, formula):
+    df = reference_get_gibbs(context, formula, df=True)
+    return list(df.sort_values(by='G')['formula'])[0]
+
+
+@functools.lru_cache(maxsize=1)
+def _dense_stoich(context):
+    # the stoich table as the original code read it, with plain columns;
+    # made once, so it isn't timed with every call
+    return context.stoich_df.astype(
+        {c: float for c in context.stoich_df.columns if c != 'formula'})
+
+
+def reference_stoich_filter(context, substances, thorough=False,
+                            exact=False):
+    from chempy import Substance
+    if type(substances) == str:
+        substances = [substances]
+    stoich_temp = _dense_stoich(context).copy()
+    composition = []
+    for s in substances:
+        composition += [*Substance.from_formula(s).composition]
+    z_keep = [0, 'formula'] + list(set(composition))
+    for col in [c for c in stoich_temp.columns if c not in z_keep]:
+        stoich_temp = stoich_temp[stoich_temp[col] == 0]
+    stoich_temp = stoich_temp.loc[(stoich_temp.drop(
+        columns=['formula']) != 0).any(axis=1)]
+    if exact:
+        thorough = True
+        composition = Substance.from_formula(substances[0]).composition
+        for z in list(composition.keys()):
+            stoich_temp = stoich_temp[stoich_temp[z] == composition[z]]
+    stoich_list = list(stoich_temp['formula'])
+    if thorough:
+        return stoich_list
+    stoich_list = [tools.formula_state_separator(f) for f in stoich_list]
+    substances = [tools.formula_state_separator(s) for s in substances]
+    return set([reference_state_predictor(context, f) for f in stoich_list
+                if f not in substances])
+
+
+def reference_balance(reactants, products):
+    # (definite, coefficients): whether check_coefficients accepted the
+    # equation, and its coefficients, reactants first
+    import sympy
+    from chempy import balance_stoichiometry
+    try:
+        balance = balance_stoichiometry(reactants, products)
+        coefficients = list(balance[0].values()) + list(balance[1].values())
+        is_positive = np.floor(
+            (np.array(coefficients) >= 1).mean()).astype(bool)
+        is_definite = np.floor(np.array(
+            [isinstance(c, sympy.Number) for c in coefficients]
+        ).mean()).astype(bool)
+    except Exception:
+        return False, None
+    if not (is_positive and is_definite):
+        return False, None
+    return True, tuple(float(c) for c in coefficients)
+
+
+def reference_delG(context, reactants, products, kJ=True):
+    from chempy import balance_stoichiometry
+    products = [reference_state_predictor(context, p) for p in products]
+    reactants = [reference_state_predictor(context, r) for r in reactants]
+    equation = balance_stoichiometry(reactants, products)
+
+    def gibbs_sum(side):
+        return sum(reference_get_gibbs(context, f) * c
+                   for f, c in side.items())
+
+    delG = gibbs_sum(equation[1]) - gibbs_sum(equation[0])
+    return float(delG) / (1 + 999*kJ)
+
+
+# sampling
+
+def sample_species(context, n, rng):
+    '''
+    --Output--
+    list (str)
+        n formulas from the thermo table, about half with their state
+        stripped
+    '''
+    formulas = list(context.thermo_df['formula'])
+    picked = [rng.choice(formulas) for _ in range(n)]
+    return [tools.formula_state_separator(f) if rng.random() < 0.5 else f
+            for f in picked]
+
+
+def sample_substance_sets(context, n, rng, max_size=3, max_elements=4):
+    '''
+    --Output--
+    list (list (str))
+        n sets of 1 to max_size species, ions included, with at most
+        max_elements elements between them
+    '''
+    matrix, _ = tools.composition_matrix(context)
+    formulas = list(context.stoich_df['formula'])
+    species = [f for i, f in enumerate(formulas)
+               if matrix.indptr[i + 1] > matrix.indptr[i]]
+    sets = []
+    while len(sets) < n:
+        substances = rng.sample(species, rng.randint(1, max_size))
+        if len(tools.Z_unique(substances) - {0}) <= max_elements:
+            sets.append(substances)
+    return sets
+
+
+def sample_equations(context, reactant_sets, n, rng, max_products=3):
+    '''
+    --Output--
+    list (tuple)
+        up to n (reactants, products) pairs, state-normalized, whose
+        products hold exactly the elements of the reactants
+    '''
+    equations = []
+    for _ in range(n * 20):
+        if len(equations) == n:
+            break
+        reactants = rng.choice(reactant_sets)
+        reactants = [tools.state_predictor(r, context=context)
+                     for r in reactants]
+        target = tools.Z_unique(reactants)
+        pool = sorted(tools.stoich_filter(reactants, context=context))
+        if not pool:
+            continue
+        products = rng.sample(pool, min(len(pool),
+                                        rng.randint(1, max_products)))
+        if tools.Z_unique(products) == target:
+            equations.append((tuple(reactants), tuple(products)))
+    return equations
+
+
+# comparisons
+
+def _same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return bool(np.isclose(a, b, rtol=RTOL, atol=0, equal_nan=True))
+    return a == b
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _outcome(fn):
+    # the result, or the type of exception both sides should agree on
+    try:
+        return fn()
+    except Exception as e:
+        return f'raises {type(e).__name__}'
+
+
+def _compare(name, inputs, reference, fast):
+    # runs every input through both sides, fast side from cold caches
+    expected, reference_ms = _timed(
+        lambda: [_outcome(lambda: reference(x)) for x in inputs])
+    tools.clear_caches()
+    got, fast_ms = _timed(lambda: [_outcome(lambda: fast(x)) for x in inputs])
+    mismatches = [(name, repr(x), repr(e), repr(g))
+                  for x, e, g in zip(inputs, expected, got)
+                  if not _same(e, g)]
+    return {'samples': len(inputs), 'mismatches': mismatches,
+            'reference_ms': reference_ms, 'fast_ms': fast_ms}
+
+
+def check_get_gibbs(context, species):
+    inputs = [(f, e) for f in species for e in ('G', 'H', 'S', 'mass')]
+    inputs += [(f, 'rows') for f in species]
+
+    def reference(x):
+        if x[1] == 'rows':
+            return list(reference_get_gibbs(context, x[0], df=True).index)
+        return float(reference_get_gibbs(context, x[0], x[1]))
+
+    def fast(x):
+        if x[1] == 'rows':
+            return list(tools.get_gibbs(x[0], df=True,
+                                        context=context).index)
+        return float(tools.get_gibbs(x[0], x[1], context=context))
+
+    return _compare('get_gibbs', inputs, reference, fast)
+
+
+def check_state_predictor(context, species):
+    return _compare(
+        'state_predictor', species,
+        lambda f: reference_state_predictor(context, f),
+        lambda f: tools.state_predictor(f, context=context))
+
+
+def check_stoich_filter(context, substance_sets):
+    inputs = [(tuple(s), mode) for s in substance_sets
+              for mode in ('default', 'thorough', 'exact')]
+
+    def kwargs(mode):
+        return {'thorough': mode == 'thorough', 'exact': mode == 'exact'}
+
+    return _compare(
+        'stoich_filter', inputs,
+        lambda x: reference_stoich_filter(context, list(x[0]),
+                                          **kwargs(x[1])),
+        lambda x: tools.stoich_filter(list(x[0]), context=context,
+                                      **kwargs(x[1])))
+
+
+def check_coefficients(context, equations):
+    def fast(x):
+        if not tools.check_coefficients(*x):
+            return False, None
+        return True, tuple(float(c) for c in tools._coefficients(*x))
+
+    return _compare('check_coefficients', equations,
+                    lambda x: reference_balance(*x), fast)
+
+
+def check_delG(context, equations):
+    '''
+    Compares standard_gibbs_free_energy, one equation at a time, with the
+    scoring of the prediction search: memoized coefficients as THERMO_DF
+    rows, one _candidate_matrix product per ENERGY_BATCH equations.
+    '''
+    balanced = [x for x in equations if reference_balance(*x)[0]]
+    expected, reference_ms = _timed(
+        lambda: [reference_delG(context, *x) for x in balanced])
+    tools.clear_caches()
+
+    def fast():
+        values = tools._thermo_arrays(context)['G']
+        energies = []
+        for first in range(0, len(balanced), tools.ENERGY_BATCH):
+            species, coefficients = [], []
+            for reactants, products in balanced[
+                    first:first + tools.ENERGY_BATCH]:
+                coefs = np.array(tools._coefficients(reactants, products),
+                                 dtype=float)
+                coefs[:len(reactants)] *= -1
+                species.append([tools._species_row(context, f)
+                                for f in reactants + products])
+                coefficients.append(coefs)
+            energies.extend(tools._candidate_matrix(
+                context, species, coefficients) @ values / 1000)
+        return energies
+
+    got, fast_ms = _timed(fast)
+    mismatches = [('delG', repr(x), repr(e), repr(float(g)))
+                  for x, e, g in zip(balanced, expected, got)
+                  if not _same(e, float(g))]
+    return {'samples': len(balanced), 'mismatches': mismatches,
+            'reference_ms': reference_ms, 'fast_ms': fast_ms}
+
+
+def run(context, samples=100, seed=0, checks=CHECKS, out=sys.stdout):
+    '''
+    Samples inputs from the context's tables and runs every check on them.
+
+    --Parameters--
+    context:        tools.Context
+    samples:        int
+        species, substance sets and equations drawn per check
+    seed:           int
+        the same seed draws the same inputs from the same tables
+
+    --Output--
+    dict
+        {check: {samples, mismatches, reference_ms, fast_ms}}; mismatches
+        are (check, input, reference result, fast result)
+    '''
+    rng = random.Random(seed)
+    species = sample_species(context, samples, rng)
+    substance_sets = sample_substance_sets(context, samples, rng)
+    equations = sample_equations(context, substance_sets, samples, rng)
+
+    runners = {
+        'get_gibbs': lambda: check_get_gibbs(context, species),
+        'state_predictor': lambda: check_state_predictor(context, species),
+        'stoich_filter': lambda: check_stoich_filter(context,
+                                                     substance_sets),
+        'check_coefficients': lambda: check_coefficients(context, equations),
+        'delG': lambda: check_delG(context, equations),
+    }
+    results = {}
+    for name in checks:
+        results[name] = r = runners[name]()
+        speedup = r['reference_ms'] / max(r['fast_ms'], 1e-9)
+        print(f"{name:<20} {r['samples']:6d} samples  "
+              f"{len(r['mismatches']):4d} mismatches  "
+              f"reference {r['reference_ms']:9.1f} ms  "
+              f"fast {r['fast_ms']:9.1f} ms  ({speedup:.1f}x)", file=out)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='compare the tools fast paths with the original '
+                    'implementations on random inputs')
+    parser.add_argument('-n', '--samples', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', choices=CHECKS, nargs='*', default=None)
+    parser.add_argument('--real', action='store_true',
+                        help='use the processed pickles instead of the '
+                             'synthetic fixture')
+    parser.add_argument('--save', help='write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.real:
+        context = tools.current_context()
+    else:
+        context = tools.Context(*synthetic_tables())
+    results = run(context, args.samples, args.seed, args.only or CHECKS)
+    mismatches = [m for r in results.values() for m in r['mismatches']]
+    for name, inputs, expected, got in mismatches:
+        print(f'MISMATCH {name} {inputs}: reference {expected}, fast {got}')
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
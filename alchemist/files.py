@@ -0,0 +1,60 @@
+'''
+content hashes and atomic writes shared by the build, export and training
+modules
+
+content_hash names data by what is in it: data versions, build cache keys and
+shard names all come from it. atomic_write replaces a file whole, so readers
+(and an interrupted run) see either the old file or the new one, never a
+truncated one.
+'''
+
+import os
+import hashlib
+import contextlib
+
+
+def content_hash(files, prefix=b''):
+    '''
+    --Parameters--
+    files:          iterable (str)
+        paths, hashed in order
+    prefix:         bytes
+        hashed ahead of the files, e.g. a build revision
+
+    --Output--
+    str
+        first 16 hex digits of the sha1 digest of prefix and the files'
+        contents
+
+    --Examples--
+    >>> content_hash(['./data/processed/stoich_df.p'])
+    '3f1c0a9b2d4e5f60'
+    '''
+    digest = hashlib.sha1(prefix)
+    for f in files:
+        with open(f, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', **kwargs):
+    '''
+    Opens a hidden temporary file next to path for writing, and moves it
+    over path once the block completes; if the block raises, path is left
+    as it was.
+
+    --Examples--
+    >>> with atomic_write('./models/word2vec/CURRENT', 'w') as fh:
+    ...     fh.write(version)
+    '''
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, f'.{name}.tmp')
+    try:
+        with open(tmp, mode, **kwargs) as fh:
+            yield fh
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,100 @@
+'''
+a small synthetic stand-in for the processed thermo/stoich tables
+
+enough Al/Ba/C/Cl/H/Na/O/S species to run every alchemist.tools function
+(including the docstring examples) without the real pickles. values are
+rounded textbook standard-state data; G and H in J mol-1, S and Cp in
+J mol-1 K-1.
+'''
+
+import numpy as np
+import pandas as pd
+
+from chempy import Substance
+
+nan = np.nan
+
+# formula, G, H, S, Cp
+SPECIES = (
+    ('Al(s)', 0, 0, 28.3, 24.2),
+    ('Al(g)', 289400, 330000, 164.6, 21.4),
+    ('Al+3(aq)', -485000, -531000, -321.7, nan),
+    ('Al2O3(s)', -1582300, -1675700, 50.9, 79.0),
+    ('Al(OH)3(s)', -1138700, -1276000, 71.0, 93.1),
+    ('AlO2-(aq)', -830900, -930900, -36.8, nan),
+    ('NaAlO2(s)', -1069200, -1133200, 70.4, 73.3),
+    ('O2(g)', 0, 0, 205.1, 29.4),
+    ('O(g)', 231730, 249170, 161.1, 21.9),
+    ('O3(g)', 163200, 142700, 238.9, 39.2),
+    ('H2(g)', 0, 0, 130.7, 28.8),
+    ('H(g)', 203260, 217960, 114.6, 20.8),
+    ('H2O(l)', -237130, -285830, 69.9, 75.3),
+    ('H2O(g)', -228570, -241820, 188.8, 33.6),
+    ('H2O2(l)', -120350, -187780, 109.6, 89.1),
+    ('OH-(aq)', -157244, -229994, -10.75, -148.5),
+    ('H+(aq)', 0, 0, 0, 0),
+    ('Na(s)', 0, 0, 51.2, 28.2),
+    ('Na(g)', 76761, 107320, 153.7, 20.8),
+    ('Na+(aq)', -261905, -240120, 59.0, 46.4),
+    ('NaOH(s)', -379494, -425609, 64.5, 59.5),
+    ('NaOH(aq)', -419150, -470114, 48.1, -102.1),
+    ('NaH(s)', -33500, -56300, 40.0, 36.4),
+    ('Na2O(s)', -379090, -417980, 75.06, 69.1),
+    ('Na2O2(s)', -449700, -510870, 95.0, 89.2),
+    ('CH4(g)', -50720, -74810, 186.3, 35.3),
+    ('CO(g)', -137168, -110525, 197.7, 29.1),
+    ('CO2(g)', -394359, -393509, 213.7, 37.1),
+    ('CO2(aq)', -385980, -413800, 117.6, nan),
+    ('C(s)', 0, 0, 5.74, 8.53),
+    ('CH3OH(l)', -166270, -238660, 126.8, 81.6),
+    ('HCO3-(aq)', -586770, -691990, 91.2, nan),
+    ('CO3-2(aq)', -527810, -677140, -56.9, nan),
+    ('C2H6(g)', -32820, -84680, 229.6, 52.6),
+    ('NaCl(s)', -384138, -411153, 72.1, 50.5),
+    ('NaCl(aq)', -393133, -407270, 115.5, -90.0),
+    ('Cl2(g)', 0, 0, 223.1, 33.9),
+    ('HCl(g)', -95299, -92307, 186.9, 29.1),
+    ('Cl-(aq)', -131228, -167159, 56.5, -136.4),
+    ('Na2CO3(s)', -1044440, -1130680, 135.0, 112.3),
+    ('BaSO4(s)', -1362200, -1473200, 132.2, 101.8),
+    ('Ba(s)', 0, 0, 62.8, 28.1),
+    ('S(s)', 0, 0, 31.8, 22.6),
+    ('SO2(g)', -300194, -296830, 248.2, 39.9),
+)
+
+
+def synthetic_tables(species=SPECIES, width=118):
+    '''
+    Builds stoich/thermo tables with the same layout as the processed pickles.
+
+    --Parameters--
+    species:        iterable (tuple)
+        (formula, G, H, S, Cp) rows
+    width:          int
+        highest atomic number given a stoich column
+
+    --Output--
+    tuple (DataFrame)
+        stoich_df, thermo_df
+
+    --Examples--
+    >>> stoich_df, thermo_df = synthetic_tables()
+    >>> thermo_df.columns.tolist()
+    ['formula', 'abbrv', 'name', 'G', 'H', 'S', 'Cp', 'mass']
+    '''
+    thermo_df = pd.DataFrame(
+        list(species), columns=['formula', 'G', 'H', 'S', 'Cp'])
+    thermo_df['abbrv'] = [f[:f.index('(')] for f in thermo_df['formula']]
+    thermo_df['name'] = nan
+    thermo_df = thermo_df[['formula', 'abbrv', 'name', 'G', 'H', 'S', 'Cp']]
+    thermo_df['mass'] = [
+        Substance.from_formula(f).mass for f in thermo_df['formula']]
+
+    # charge in column 0, one column per element after that
+    stoich = np.zeros((len(thermo_df), width + 1))
+    for i, f in enumerate(thermo_df['formula']):
+        for z, n in Substance.from_formula(f).composition.items():
+            stoich[i, z] = n
+    stoich_df = pd.DataFrame(stoich, columns=range(width + 1))
+    stoich_df.insert(0, 'formula', thermo_df['formula'])
+    return stoich_df, thermo_df
@@ -0,0 +1,155 @@
+'''
+background jobs for long-running predictions
+
+the web app hands slow work to a JobQueue and returns a job id straight away;
+clients then poll or stream the job, including its latest progress report,
+until it finishes. every job gets a time budget, after which it is reported
+as expired and its late result dropped. threads can't be stopped from outside,
+so a job only frees its worker on time if it takes the deadline_ms it is given
+with deadline=True (reaction_predictor and prediction_events do); any other
+job keeps its worker until it returns.
+'''
+
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+EXPIRED = 'expired'
+FINISHED = (DONE, FAILED, EXPIRED)
+# share of the budget given to deadline-aware jobs, leaving them time to
+# return their best answer before they expire
+DEADLINE_SHARE = 0.9
+
+
+class JobQueue:
+    '''
+    A small pool of worker threads with per-job bookkeeping.
+
+    --Parameters--
+    workers:        int
+        number of jobs allowed to run at once
+    budget:         float
+        default number of seconds a job may run before it expires
+    keep:           int
+        number of finished jobs remembered for polling
+    '''
+
+    def __init__(self, workers=2, budget=60, keep=1000):
+        self.budget = budget
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, fn, *args, budget=None, progress=False, deadline=False,
+               **kwargs):
+        '''
+        Queues fn(*args, **kwargs) and returns the new job's id.
+
+        With progress=True, fn is also passed a callback= keyword; whatever
+        it is called with becomes the job's 'progress' field.
+
+        With deadline=True, fn is also passed a deadline_ms= keyword, set
+        when the job starts to DEADLINE_SHARE of its budget, so that it can
+        stop and give its worker back before expiring.
+        '''
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': QUEUED,
+            'budget': self.budget if budget is None else budget,
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'progress': None,
+            'result': None,
+            'error': None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._forget_old()
+        if progress:
+            kwargs['callback'] = lambda report: self._report(job, report)
+        self._pool.submit(self._run, job, fn, args, kwargs, deadline)
+        return job_id
+
+    def status(self, job_id):
+        '''
+        Returns a copy of the job's record, or None for an unknown id.
+
+        --Output--
+        dict
+            id, status, budget, submitted, started, finished, progress,
+            result, error
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            self._check_budget(job)
+            return dict(job)
+
+    def wait(self, job_id, timeout=None):
+        '''
+        Blocks until the job changes state (or timeout seconds pass) and
+        returns its record.
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] not in FINISHED:
+                self._changed.wait(timeout)
+        return self.status(job_id)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job, fn, args, kwargs, deadline=False):
+        with self._lock:
+            job['status'] = RUNNING
+            job['started'] = time.time()
+            self._changed.notify_all()
+        if deadline:
+            # counted from now, not submission: queueing isn't budgeted
+            kwargs['deadline_ms'] = job['budget'] * 1000 * DEADLINE_SHARE
+        try:
+            result, error = fn(*args, **kwargs), None
+        except Exception as e:
+            result, error = None, f'{type(e).__name__}: {e}'
+        with self._lock:
+            self._check_budget(job)
+            if job['status'] == RUNNING:
+                job['status'] = DONE if error is None else FAILED
+                job['result'] = result
+                job['error'] = error
+                job['finished'] = time.time()
+            self._changed.notify_all()
+
+    def _report(self, job, report):
+        with self._lock:
+            if job['status'] == RUNNING:
+                job['progress'] = report
+                self._changed.notify_all()
+
+    def _check_budget(self, job):
+        # threads can't be killed, so an overrun job is marked expired and
+        # whatever it returns afterwards is thrown away; it holds its worker
+        # until then unless it honours deadline_ms
+        if job['status'] == RUNNING and \
+                time.time() - job['started'] > job['budget']:
+            job['status'] = EXPIRED
+            job['error'] = f"exceeded its {job['budget']}s budget"
+            job['finished'] = time.time()
+            self._changed.notify_all()
+
+    def _forget_old(self):
+        finished = [j for j in self._jobs.values()
+                    if j['status'] in FINISHED]
+        for job in sorted(finished, key=lambda j: j['finished'])[
+                :max(0, len(finished) - self.keep)]:
+            del self._jobs[job['id']]
@@ -0,0 +1,150 @@
+'''
+opt-in timers and counters for the prediction pipeline
+
+nothing is recorded unless a collect() block is active, so the hooks left in
+alchemist.tools cost one context-variable lookup when switched off.
+
+    >>> with collect() as m:
+    ...     reaction_predictor(['Al', 'O2'])
+    >>> m.as_dict()['timers']['stage.balance']
+    {'calls': 4, 'total_ms': 41.2, 'mean_ms': 10.3, 'max_ms': 15.9}
+
+collection follows the current thread (and asyncio task), so concurrent
+requests each see only their own timers and counters. cache statistics come
+from shared caches and include other threads' traffic.
+'''
+
+import json
+import time
+import functools
+import contextlib
+import contextvars
+from collections import defaultdict
+
+_CURRENT = contextvars.ContextVar('alchemist_metrics', default=None)
+
+# name -> callable returning (hits, misses); see register_cache
+CACHES = {}
+
+
+class Metrics:
+    '''
+    Timers, counters and cache statistics gathered by one collect() block.
+    '''
+
+    def __init__(self):
+        self.timers = defaultdict(list)
+        self.counters = defaultdict(int)
+        self._caches_before = {name: f() for name, f in CACHES.items()}
+        self._caches_after = None
+
+    def as_dict(self):
+        '''
+        --Output--
+        dict
+            timers:     {name: {calls, total_ms, mean_ms, max_ms}}
+            counters:   {name: int}
+            caches:     {name: {hits, misses, hit_rate}}
+        '''
+        timers = {}
+        for name, times in self.timers.items():
+            total = sum(times) * 1000
+            timers[name] = {'calls': len(times), 'total_ms': total,
+                            'mean_ms': total / len(times),
+                            'max_ms': max(times) * 1000}
+        after = self._caches_after or {
+            name: f() for name, f in CACHES.items()}
+        caches = {}
+        for name, (hits, misses) in after.items():
+            hits0, misses0 = self._caches_before.get(name, (0, 0))
+            hits, misses = hits - hits0, misses - misses0
+            caches[name] = {'hits': hits, 'misses': misses,
+                            'hit_rate': hits / (hits + misses)
+                            if hits + misses else None}
+        return {'timers': timers, 'counters': dict(self.counters),
+                'caches': caches}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def dump(self, path):
+        '''
+        Writes as_dict() to a JSON file.
+        '''
+        with open(path, 'w') as fh:
+            json.dump(self.as_dict(), fh, indent=2)
+
+
+@contextlib.contextmanager
+def collect():
+    '''
+    Records every timer and counter hit inside the block into a new Metrics.
+    '''
+    metrics = Metrics()
+    token = _CURRENT.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _CURRENT.reset(token)
+        metrics._caches_after = {name: f() for name, f in CACHES.items()}
+
+
+def count(name, n=1):
+    '''
+    Adds n to a counter, if collection is on.
+    '''
+    metrics = _CURRENT.get()
+    if metrics is not None:
+        metrics.counters[name] += n
+
+
+@contextlib.contextmanager
+def timer(name):
+    '''
+    Times the enclosed block, if collection is on.
+    '''
+    metrics = _CURRENT.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timers[name].append(time.perf_counter() - start)
+
+
+def timed(fn):
+    '''
+    Decorator timing every call of fn under its own name. Keeps the cache
+    controls of functools.lru_cache functions reachable.
+    '''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        metrics = _CURRENT.get()
+        if metrics is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.timers[fn.__name__].append(time.perf_counter() - start)
+
+    for attr in ('cache_clear', 'cache_info'):
+        if hasattr(fn, attr):
+            setattr(wrapper, attr, getattr(fn, attr))
+    return wrapper
+
+
+def register_cache(name, stats):
+    '''
+    Reports a cache's hit rate in every Metrics.
+
+    --Parameters--
+    stats:          callable or functools.lru_cache function
+        returns (hits, misses) when called
+    '''
+    if hasattr(stats, 'cache_info'):
+        info = stats.cache_info
+        stats = lambda: (info().hits, info().misses)
+    CACHES[name] = stats
@@ -0,0 +1,164 @@
+'''
+precomputed reactions for common element systems
+
+most queries fall within a few hundred small element systems ({Al, O},
+{Na, H, O}, {C, H, O}, ...). build_network runs the full search offline for
+every small reactant set in each system and stores the winning reaction,
+with its coefficients and delG, in an on-disk table indexed by element set.
+reaction_predictor then answers those queries with a lookup instead of a
+search.
+
+command line:
+    python -m alchemist.network --max-elements 3
+    python -m alchemist.network --systems Al,O Na,H,O C,H,O
+'''
+
+import sys
+import argparse
+import itertools
+import multiprocessing
+
+from chempy import Substance
+
+from alchemist import tools
+from alchemist import periodic
+from alchemist.cache import ReactionNetwork, reactants_key
+
+
+def element_systems(max_elements=3):
+    '''
+    Lists every element set of up to max_elements elements that is part of
+    some species in STOICH_DF.
+
+    --Output--
+    list (frozenset (int))
+    '''
+    systems = set()
+    for formula in tools.STOICH_DF['formula']:
+        elements = sorted(tools.Z_unique([formula]) - {0})
+        for n in range(1, min(max_elements, len(elements)) + 1):
+            systems.update(frozenset(c)
+                           for c in itertools.combinations(elements, n))
+    return sorted(systems, key=lambda s: (len(s), sorted(s)))
+
+
+def reactant_sets(elements, max_reactants=2, max_atoms=5):
+    '''
+    Lists the reactant sets stored for an element system: combinations of up
+    to max_reactants neutral species, each with at most max_atoms atoms, that
+    together contain exactly these elements.
+
+    --Output--
+    list (tuple (str))
+        state-normalized formulas
+    '''
+    pool = set()
+    for formula in tools.stoich_filter(list(_formulas(elements)),
+                                       thorough=True):
+        composition = Substance.from_formula(formula).composition
+        if composition.get(0, 0) == 0 and \
+                sum(composition.values()) <= max_atoms:
+            pool.add(tools.state_predictor(
+                tools.formula_state_separator(formula)))
+    sets = []
+    for n in range(1, max_reactants + 1):
+        for combination in itertools.combinations(sorted(pool), n):
+            if tools.Z_unique(list(combination)) == set(elements):
+                sets.append(combination)
+    return sets
+
+
+def _formulas(elements):
+    # one formula per element, enough for stoich_filter to scope the system
+    return [periodic.symbols[z] for z in sorted(elements)]
+
+
+def _predict(args):
+    reactants, elements, max_length = args
+    try:
+        prediction = tools.reaction_predictor(
+            reactants, max_length=max_length, cache=False, full_output=True)
+    except Exception:
+        return None
+    if prediction.reaction is None:
+        return None
+    return reactants, elements, prediction.reaction, prediction.energy
+
+
+def build_network(path=None, systems=None, max_elements=3, max_reactants=2,
+                  max_atoms=5, max_length=12, processes=None, out=sys.stdout):
+    '''
+    Runs reaction_predictor for every reactant set of every element system
+    and stores the results, skipping sets already built for this data
+    version.
+
+    --Parameters--
+    path:           str or None
+        SQLite file; defaults to tools.NETWORK's
+    systems:        iterable (iterable (int)) or None
+        element systems to build; None builds element_systems(max_elements)
+    processes:      int or None
+        worker processes; None uses every core
+
+    --Output--
+    int
+        number of reactions stored
+    '''
+    network = tools.NETWORK if path is None else ReactionNetwork(path)
+    version = tools.DATA_VERSION
+    network.prune(version)
+    if systems is None:
+        systems = element_systems(max_elements)
+
+    tasks = []
+    for elements in systems:
+        elements = frozenset(elements)
+        built = {r for r, m, _, _ in network.system(elements, version)
+                 if m == max_length}
+        tasks += [(list(r), elements, max_length)
+                  for r in reactant_sets(elements, max_reactants, max_atoms)
+                  if reactants_key(r) not in built]
+    print(f'{len(tasks)} reactant sets in {len(systems)} systems', file=out)
+
+    stored = 0
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(_predict, tasks):
+            if result is None:
+                continue
+            reactants, elements, reaction, energy = result
+            network.add(reactants, elements, max_length, version, reaction,
+                        energy)
+            stored += 1
+            if stored % 100 == 0:
+                network.commit()
+                print(f'  {stored} stored', file=out)
+    network.commit()
+    return stored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='precompute reactions for small element systems')
+    parser.add_argument('--path', default=None,
+                        help='SQLite file (default: next to the data)')
+    parser.add_argument('--systems', nargs='*', default=None,
+                        help='comma-separated element symbols, e.g. Na,H,O')
+    parser.add_argument('--max-elements', type=int, default=3)
+    parser.add_argument('--max-reactants', type=int, default=2)
+    parser.add_argument('--max-atoms', type=int, default=5)
+    parser.add_argument('--max-length', type=int, default=12)
+    parser.add_argument('-p', '--processes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    systems = None
+    if args.systems:
+        systems = [{periodic.Z(s) for s in system.split(',')}
+                   for system in args.systems]
+    stored = build_network(
+        args.path, systems, args.max_elements, args.max_reactants,
+        args.max_atoms, args.max_length, args.processes)
+    print(f'{stored} reactions stored')
+
+
+if __name__ == '__main__':
+    main()
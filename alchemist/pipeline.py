@@ -0,0 +1,349 @@
+'''
+builds the processed thermo/stoich tables from the external sources
+
+replaces the hand-run cells of notebook 03. CHNOSZ's table and the Oxtoby
+appendix PDFs are cleaned column-wise, merged and deduplicated; every
+distinct formula is parsed once, and its composition feeds both the stoich
+columns and the masses, which come out of one matrix product.
+
+each source's cleaned table is cached under CACHE_DIR by the hash of its
+files, and parsed compositions are kept across builds, so a rebuild after
+a change to one source skips tika and only parses new formulas. the outputs
+are the processed pickles, their memory-mapped export (alchemist.shared)
+and BUILD_FILE, which records the source hashes and the data version that
+downstream caches key on.
+
+command line:
+    python -m alchemist.pipeline
+    python -m alchemist.pipeline --source ./data/external/thermo/ --force
+'''
+
+import os
+import re
+import sys
+import json
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from alchemist import tools
+from alchemist import shared
+from alchemist.files import content_hash, atomic_write
+
+SOURCE_DIR = './data/external/thermo/'
+CACHE_DIR = './data/interim/build/'
+CHNOSZ_FILE = 'chnosz_thermo.csv'
+OXTOBY_FILES = ['oxtoby8a.pdf', 'oxtoby8b.pdf']
+# kept across builds: {formula: chempy composition, or None if unparsable}
+COMPOSITIONS_FILE = 'compositions.p'
+# written next to the pickles: source hashes and the resulting data version
+BUILD_FILE = 'build.json'
+# bump when a stage's output changes for the same sources
+BUILD_REVISION = 1
+
+ENERGY_COLUMNS = ['G', 'H', 'S', 'Cp']
+THERMO_COLUMNS = ['formula', 'abbrv', 'name', 'G', 'H', 'S', 'Cp']
+CAL = 4.184
+# CHNOSZ state codes, as written after a formula
+STATES = {'aq': '(aq)', 'cr': '(s)', 'liq': '(l)', 'gas': '(g)', 'g': '(g)',
+          'cr2': '(s, II)', 'cr3': '(s, III)', 'cr4': '(s, IV)',
+          'cr5': '(s, V)', 'cr6': '(s, VI)', 'cr7': '(s, VII)',
+          'cr8': '(s, VIII)', 'cr9': '(s, IX)'}
+# CHNOSZ's water row is replaced by the textbook values, in J
+WATER = {'G': -237180, 'H': -285830, 'S': 69.91, 'Cp': 75.29}
+# chempy's mass_from_composition charges a net positive charge this much
+ELECTRON_MASS = 5.489e-4
+# Oxtoby PDF text -> one 'formula H S G Cp' row per line, applied in order
+OXTOBY_RULES = [('—', 'nan'),
+                (r'\ue02c', 'l'),
+                (r'\n\n[I]*\s*', 'RROOWW'),
+                (r'([\d]+)\n([A-Z]+)', r'\1RROOWW\2'),
+                (r'(nan)\s*\n([A-Z]+)', r'\1RROOWW\2'),
+                (r'\ue031', '+'),
+                (r'([\d])\+\(', r'+\1('),
+                (r'\ue032', '-'),
+                (r'([\d])\-\(', r'-\1('),
+                (r'\(([aqslg]+)\,\s([\w]+)', r'(\1,\2'),
+                (r'[\s]+', ' '),
+                (' mol-1', '')]
+
+
+def source_hash(files):
+    '''
+    --Output--
+    str
+        first 16 hex digits of the sha1 digest of the files' contents, in
+        order, and BUILD_REVISION
+    '''
+    return content_hash(files, str(BUILD_REVISION).encode())
+
+
+def _dump(value, path):
+    # write whole, so an interrupted build never leaves a truncated artifact
+    with atomic_write(path) as fh:
+        pickle.dump(value, fh)
+
+
+def _cached(name, files, build, cache_dir=CACHE_DIR, force=False,
+            out=sys.stdout):
+    # result of build(), stored once per content hash of files
+    key = source_hash(files)
+    path = os.path.join(cache_dir, f'{name}-{key}.p')
+    if os.path.exists(path) and not force:
+        print(f'{name}: cached ({key})', file=out)
+        with open(path, 'rb') as fh:
+            return pickle.load(fh), key
+    print(f'{name}: building ({key})', file=out)
+    value = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    _dump(value, path)
+    return value, key
+
+
+def clean_chnosz(chnosz):
+    '''
+    Cleans CHNOSZ's thermo table as notebook 03 did: energies in J, the
+    textbook water values, and states appended to the formulas.
+
+    --Parameters--
+    chnosz:         DataFrame
+        chnosz_thermo.csv as read
+
+    --Output--
+    DataFrame
+        formula, abbrv, name, G, H, S, Cp; rows without G dropped
+    '''
+    chnosz = chnosz[['name', 'abbrv', 'formula', 'E_units', 'state']
+                    + ENERGY_COLUMNS]
+    chnosz = chnosz[chnosz['name'].str[0] != '['].copy()
+    scale = np.where(chnosz['E_units'] == 'cal', CAL, 1.0)
+    chnosz[ENERGY_COLUMNS] = chnosz[ENERGY_COLUMNS].mul(scale, axis=0)
+    if 0 in chnosz.index:
+        chnosz.loc[0, list(WATER)] = list(WATER.values())
+    state = chnosz['state'].map(STATES).fillna(chnosz['state'])
+    chnosz['formula'] = chnosz['formula'].astype(str) + state.astype(str)
+    if 1 in chnosz.index:
+        chnosz.loc[1, 'formula'] = 'e-(aq)'
+    chnosz = chnosz.dropna(subset=['G'])
+    return chnosz[['formula', 'abbrv', 'name'] + ENERGY_COLUMNS]
+
+
+def parse_oxtoby(text):
+    '''
+    Reads the rows of an Oxtoby thermodynamic appendix from its PDF text.
+
+    --Parameters--
+    text:           str
+        as returned by alchemist.text.get_text
+
+    --Output--
+    DataFrame
+        formula, G, H, S, Cp in J; rows without G dropped
+    '''
+    for pattern, replacement in OXTOBY_RULES:
+        text = re.sub(pattern, replacement, text)
+    rows = [r.split(' ') for r in text.split('RROOWW')]
+    rows = [r for r in rows if len(r) == 5]
+    oxtoby = pd.DataFrame(rows, columns=['formula', 'H', 'S', 'G', 'Cp'])
+    oxtoby[ENERGY_COLUMNS] = oxtoby[ENERGY_COLUMNS].astype(float)
+    # tabulated in kJ
+    oxtoby[['H', 'G']] *= 1000
+    return oxtoby[['formula'] + ENERGY_COLUMNS].dropna(subset=['G'])
+
+
+def merge_tables(chnosz, oxtoby):
+    '''
+    Stacks the cleaned sources, the later one winning duplicate formulas,
+    and drops hydrates and other dotted formulas.
+
+    --Output--
+    DataFrame
+        THERMO_COLUMNS, one row per formula, abbrv filled with the bare
+        formula where missing
+    '''
+    thermo_df = pd.concat([chnosz, oxtoby], ignore_index=True)
+    thermo_df = thermo_df[THERMO_COLUMNS]
+    thermo_df = thermo_df.drop_duplicates(subset='formula', keep='last')
+    formulas = thermo_df['formula'].astype(str)
+    thermo_df = thermo_df[~formulas.str.contains('.', regex=False)]
+    thermo_df = thermo_df.reset_index(drop=True)
+    # same as formula_state_separator, for the whole column at once
+    bare = thermo_df['formula'].astype(str).str.replace(
+        r'\([aglsq].*$', '', n=1, regex=True)
+    thermo_df['abbrv'] = thermo_df['abbrv'].fillna(bare)
+    return thermo_df
+
+
+def compositions(formulas, path=None):
+    '''
+    Parses each distinct formula once, reusing the compositions stored at
+    path by earlier builds.
+
+    --Parameters--
+    formulas:       iterable (str)
+    path:           str or None
+        pickle of {formula: composition}; updated with new formulas
+
+    --Output--
+    dict
+        {formula: chempy composition, or None if chempy cannot parse it}
+    '''
+    from chempy import Substance
+    known = {}
+    if path is not None and os.path.exists(path):
+        with open(path, 'rb') as fh:
+            known = pickle.load(fh)
+    new = [f for f in dict.fromkeys(formulas) if f not in known]
+    for f in new:
+        try:
+            known[f] = dict(Substance.from_formula(f).composition)
+        except Exception:
+            known[f] = None
+    if new and path is not None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        _dump(known, path)
+    return known
+
+
+def stoich_table(formulas, compositions):
+    '''
+    Lays compositions out as STOICH_DF: a formula column, then one float
+    column per atomic number (0 for charge) that occurs, sorted.
+
+    --Parameters--
+    formulas:       list (str)
+        one row each, in order
+    compositions:   dict
+        from compositions(); unparsable formulas get a row of zeros
+    '''
+    rows, keys, counts = [], [], []
+    for i, f in enumerate(formulas):
+        composition = compositions.get(f) or {}
+        rows += [i] * len(composition)
+        keys += list(composition)
+        counts += list(composition.values())
+    columns, position = np.unique(np.asarray(keys, dtype=int),
+                                  return_inverse=True)
+    matrix = np.zeros((len(formulas), len(columns)))
+    matrix[np.asarray(rows, dtype=int), position] = counts
+    stoich_df = pd.DataFrame(matrix, columns=[int(c) for c in columns])
+    stoich_df.insert(0, 'formula', list(formulas))
+    return stoich_df
+
+
+def masses(stoich_df):
+    '''
+    --Output--
+    numpy.ndarray
+        molar mass of each stoich_df row, as chempy's Substance.mass
+    '''
+    from chempy.util.periodic import relative_atomic_masses
+    Z = np.array([c for c in stoich_df.columns
+                  if c != 'formula' and c != 0], dtype=int)
+    weights = np.asarray(relative_atomic_masses, dtype=float)[Z - 1]
+    mass = stoich_df[list(Z)].to_numpy(dtype=float) @ weights
+    if 0 in stoich_df.columns:
+        mass -= stoich_df[0].to_numpy(dtype=float) * ELECTRON_MASS
+    return mass
+
+
+def build(source_dir=SOURCE_DIR, data_dir=tools.DATA_DIR,
+          cache_dir=CACHE_DIR, shared_dir=shared.SHARED_DIR, force=False,
+          out=sys.stdout):
+    '''
+    Rebuilds thermo_df.p and stoich_df.p from the sources, unless BUILD_FILE
+    shows they were built from the same ones, and exports them for
+    memory-mapped loading.
+
+    --Parameters--
+    shared_dir:     str or None
+        where to export the memory-mapped tables; None skips the export
+    force:          bool
+        ignore cached artifacts and rebuild every stage
+
+    --Output--
+    str
+        data version of the tables, as tools.data_version computes it
+    '''
+    chnosz_file = os.path.join(source_dir, CHNOSZ_FILE)
+    oxtoby_files = [os.path.join(source_dir, f) for f in OXTOBY_FILES]
+    sources = {'chnosz': source_hash([chnosz_file]),
+               'oxtoby': source_hash(oxtoby_files)}
+    record = _read_record(data_dir)
+    if not force and record.get('sources') == sources and all(
+            os.path.exists(os.path.join(data_dir, f))
+            for f in tools.DATA_FILES):
+        print(f"up to date: data version {record['version']}", file=out)
+        return record['version']
+
+    chnosz, _ = _cached(
+        'chnosz', [chnosz_file],
+        lambda: clean_chnosz(pd.read_csv(chnosz_file)),
+        cache_dir, force, out)
+    oxtoby, _ = _cached(
+        'oxtoby', oxtoby_files, lambda: _read_oxtoby(oxtoby_files),
+        cache_dir, force, out)
+
+    thermo_df = merge_tables(chnosz, oxtoby)
+    formulas = list(thermo_df['formula'].astype(str))
+    parsed = compositions(
+        formulas, None if force else os.path.join(cache_dir,
+                                                  COMPOSITIONS_FILE))
+    # one row per formula in both tables, in the same order
+    stoich_df = stoich_table(formulas, parsed)
+    mass = masses(stoich_df)
+    mass[[parsed[f] is None for f in formulas]] = np.nan
+    thermo_df['mass'] = mass
+
+    os.makedirs(data_dir, exist_ok=True)
+    _dump(thermo_df, os.path.join(data_dir, 'thermo_df.p'))
+    _dump(stoich_df, os.path.join(data_dir, 'stoich_df.p'))
+    version = tools.data_version(data_dir=data_dir)
+    if shared_dir is not None:
+        shared.export_tables(stoich_df, thermo_df, version, shared_dir)
+    with open(os.path.join(data_dir, BUILD_FILE), 'w') as fh:
+        json.dump({'version': version, 'sources': sources,
+                   'species': len(thermo_df)}, fh, indent=2)
+    print(f'built {len(thermo_df)} species, data version {version}',
+          file=out)
+    return version
+
+
+def _read_oxtoby(files):
+    # tika is only needed when the PDFs have changed
+    from alchemist.text import get_text
+    return pd.concat([parse_oxtoby(get_text(f)) for f in files],
+                     ignore_index=True)
+
+
+def _read_record(data_dir):
+    try:
+        with open(os.path.join(data_dir, BUILD_FILE)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='build the processed thermo/stoich tables')
+    parser.add_argument('--source', default=SOURCE_DIR,
+                        help='directory with the CHNOSZ csv and Oxtoby PDFs')
+    parser.add_argument('--data-dir', default=tools.DATA_DIR)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--shared-dir', default=shared.SHARED_DIR)
+    parser.add_argument('--no-export', action='store_true',
+                        help='skip the memory-mapped export')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild every stage')
+    args = parser.parse_args(argv)
+
+    version = build(args.source, args.data_dir, args.cache_dir,
+                    None if args.no_export else args.shared_dir, args.force)
+    print(version)
+
+
+if __name__ == '__main__':
+    main()
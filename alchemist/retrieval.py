@@ -0,0 +1,226 @@
+'''
+textbook chapter retrieval with Doc2Vec
+
+the chapter vectors of a trained Doc2Vec model (notebook E) are stored once as
+a contiguous, unit-normalized matrix. a problem's vector comes from
+infer_vector, an iterative optimization, so inferred vectors are cached by
+the tokens they were inferred from. a batch of problems is matched against
+every chapter with one matrix product.
+
+    >>> retriever = ChapterRetriever(model, load_index())
+    >>> retriever.top_k(['balance the equation for burning methane'], k=3)
+    [[('chapter 3', 0.81), ('chapter 4', 0.64), ('chapter 9', 0.31)]]
+
+command line:
+    python -m alchemist.retrieval build ./data/processed/model_1324.p
+'''
+
+import os
+import re
+import sys
+import json
+import pickle
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from alchemist import metrics
+
+INDEX_DIR = './models/chapters/'
+VECTORS_FILE = 'vectors.npy'
+LABELS_FILE = 'labels.json'
+# nltk's wordpunct_tokenize, which notebook E trained on
+TOKEN = re.compile(r'\w+|[^\w\s]+')
+
+# (hits, misses) of every ChapterRetriever's cache, for metrics
+_STATS = [0, 0]
+_STATS_LOCK = threading.Lock()
+
+
+def _count(hit):
+    with _STATS_LOCK:
+        _STATS[0 if hit else 1] += 1
+
+
+metrics.register_cache('inferred_vectors', lambda: tuple(_STATS))
+
+
+def tokenize(text):
+    '''
+    Splits text as notebook E did, case preserved.
+
+    --Examples--
+    >>> tokenize('Balance  CH4 + O2')
+    ['Balance', 'CH4', '+', 'O2']
+    '''
+    return TOKEN.findall(text)
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def build_index(model, path=INDEX_DIR, labels=None):
+    '''
+    Stores the document vectors of a Doc2Vec model as one unit-normalized
+    float32 matrix, with one label per row.
+
+    --Parameters--
+    model:          gensim.models.Doc2Vec
+    labels:         dict or None
+        display label per document tag; tags are used as they are otherwise
+    '''
+    os.makedirs(path, exist_ok=True)
+    tags = list(model.dv.index_to_key)
+    vectors = np.ascontiguousarray(
+        _unit_rows(np.asarray(model.dv.vectors, dtype=np.float32)))
+    labels = [str((labels or {}).get(t, t)) for t in tags]
+    np.save(os.path.join(path, VECTORS_FILE), vectors)
+    with open(os.path.join(path, LABELS_FILE), 'w') as fh:
+        json.dump(labels, fh)
+
+
+def load_index(path=INDEX_DIR):
+    '''
+    --Output--
+    tuple
+        (chapters x dimensions) matrix, memory-mapped read-only, and the
+        list of chapter labels
+    '''
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r')
+    with open(os.path.join(path, LABELS_FILE)) as fh:
+        labels = json.load(fh)
+    return vectors, labels
+
+
+class ChapterRetriever:
+    '''
+    Finds the chapters closest to problem texts.
+
+    --Parameters--
+    model:          gensim.models.Doc2Vec
+        used only to infer vectors for new problems
+    index:          tuple
+        (vectors, labels) from load_index
+    maxsize:        int
+        inferred vectors kept, least recently used dropped first
+    '''
+
+    def __init__(self, model, index, maxsize=4096, epochs=None):
+        self.model = model
+        self.vectors, self.labels = index
+        self.maxsize = maxsize
+        self.epochs = epochs
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def vector(self, text):
+        '''
+        --Output--
+        numpy.ndarray
+            the unit-length inferred vector of text, cached by its tokens,
+            so texts differing only in spacing share an entry
+        '''
+        key = tuple(tokenize(text))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                _count(True)
+                return self._cache[key]
+            self.misses += 1
+        _count(False)
+        # inference runs outside the lock; a duplicate miss just recomputes
+        vector = self.model.infer_vector(list(key), epochs=self.epochs)
+        vector = _unit_rows(np.asarray(vector, dtype=np.float32)[None])[0]
+        vector.setflags(write=False)
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return vector
+
+    def scores(self, problems):
+        '''
+        --Output--
+        numpy.ndarray
+            (problems x chapters) cosine similarities
+        '''
+        with metrics.timer('retrieval.infer'):
+            queries = np.stack([self.vector(p) for p in problems])
+        with metrics.timer('retrieval.match'):
+            return queries @ self.vectors.T
+
+    def top_k(self, problems, k=5):
+        '''
+        --Parameters--
+        problems:       iterable (str)
+
+        --Output--
+        list (list (tuple))
+            per problem, up to k (label, similarity) pairs, best first
+        '''
+        problems = list(problems)
+        if not problems:
+            return []
+        scores = self.scores(problems)
+        k = min(k, scores.shape[1])
+        # partial sort: only the k best per row are ordered
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, columns in zip(scores, best):
+            columns = columns[np.argsort(-row[columns])]
+            results.append([(self.labels[c], float(row[c])) for c in columns])
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='match problems to textbook chapters with Doc2Vec')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='store chapter vectors')
+    build.add_argument('model', help='pickled or saved gensim Doc2Vec')
+    build.add_argument('-o', '--out', default=INDEX_DIR)
+    build.add_argument('--labels', default=None,
+                       help='JSON object of tag -> label')
+    query = commands.add_parser(
+        'query', help='top chapters for each line of a text file')
+    query.add_argument('model')
+    query.add_argument('problems', help="text file, one problem per line "
+                                        "('-' reads stdin)")
+    query.add_argument('--index', default=INDEX_DIR)
+    query.add_argument('-k', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    model = _load_model(args.model)
+    if args.command == 'build':
+        labels = None
+        if args.labels:
+            with open(args.labels) as fh:
+                labels = json.load(fh)
+        build_index(model, args.out, labels)
+        return
+    fh = sys.stdin if args.problems == '-' else open(args.problems)
+    with fh:
+        problems = [line.strip() for line in fh if line.strip()]
+    retriever = ChapterRetriever(model, load_index(args.index))
+    for problem, matches in zip(problems, retriever.top_k(problems, args.k)):
+        print(json.dumps({'problem': problem, 'chapters': matches}))
+
+
+def _load_model(path):
+    if path.endswith('.p'):
+        with open(path, 'rb') as fh:
+            return pickle.load(fh)
+    from gensim.models.doc2vec import Doc2Vec
+    return Doc2Vec.load(path)
+
+
+if __name__ == '__main__':
+    main()
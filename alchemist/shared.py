@@ -0,0 +1,168 @@
+'''
+memory-mapped species tables and word vectors for multi-process deployments
+
+every worker of the Flask app or of a batch run otherwise unpickles its own
+copy of STOICH_DF, THERMO_DF and the word-vector model. export writes the
+thermo columns once as a .npy file; workers attach read-only memory maps of
+it, so the pages are shared through the OS page cache. the stoich table is
+exported as its non-zero counts only, a few per species, which each worker
+loads into the sparse columns tools.Context keeps anyway. an extra worker
+then only adds those counts, the strings and its own memoized lookups.
+
+command line (once per data build, e.g. from the deploy script):
+    python -m alchemist.shared --model ./data/processed/model_1324.p
+
+workers then call use_shared() and attach_vectors() instead of unpickling.
+'''
+
+import os
+import sys
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from alchemist import tools
+from alchemist.files import atomic_write
+
+SHARED_DIR = os.path.join(tools.DATA_DIR, 'shared')
+STOICH_FILE = 'stoich.npz'
+THERMO_FILE = 'thermo.npy'
+# written last; its presence marks a complete export
+META_FILE = 'meta.p'
+VECTORS_FILE = 'vectors.kv'
+# THERMO_DF columns kept in the memory map; the rest travel in META_FILE
+THERMO_NUMERIC = ['G', 'H', 'S', 'Cp', 'mass']
+
+
+def export_tables(stoich_df, thermo_df, version, path=SHARED_DIR):
+    '''
+    Writes the stoich/thermo tables as memory-mappable arrays plus a small
+    pickle of their strings and layout.
+
+    --Parameters--
+    stoich_df:      DataFrame
+    thermo_df:      DataFrame
+        laid out like the processed pickles
+    version:        str
+        data version the tables were loaded as, e.g. tools.DATA_VERSION
+    '''
+    from scipy import sparse
+    os.makedirs(path, exist_ok=True)
+    numeric = stoich_df.drop(columns=['formula'])
+    # column by column, as the sparse columns are rebuilt from it
+    stoich = sparse.csc_matrix(numeric.to_numpy(dtype=float))
+    # one contiguous row per column, so every column maps as a plain view
+    thermo = np.ascontiguousarray(
+        thermo_df[THERMO_NUMERIC].to_numpy(dtype=float).T)
+    meta = {'version': version,
+            'stoich_columns': list(numeric.columns),
+            'stoich_formula': list(stoich_df['formula']),
+            'thermo_columns': list(thermo_df.columns),
+            'thermo_strings': {c: thermo_df[c].reset_index(drop=True)
+                               for c in thermo_df.columns
+                               if c not in THERMO_NUMERIC}}
+    # replace files whole, so workers still mapping the old export keep
+    # reading a consistent (if stale) copy
+    with atomic_write(os.path.join(path, STOICH_FILE)) as fh:
+        sparse.save_npz(fh, stoich)
+    with atomic_write(os.path.join(path, THERMO_FILE)) as fh:
+        np.save(fh, thermo)
+    with atomic_write(os.path.join(path, META_FILE)) as fh:
+        pickle.dump(meta, fh)
+
+
+def exported(path=SHARED_DIR):
+    '''
+    --Output--
+    bool
+        whether export_tables has completed in path
+    '''
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def attach_tables(path=SHARED_DIR):
+    '''
+    Rebuilds the stoich/thermo tables from an export. The thermo numeric
+    columns are views of read-only memory maps, not copies; the stoich
+    counts come back as sparse columns.
+
+    --Output--
+    tuple
+        stoich_df, thermo_df, version
+
+    --Examples--
+    >>> stoich_df, thermo_df, version = attach_tables()
+    >>> thermo_df['G'].to_numpy().flags.writeable
+    False
+    '''
+    from scipy import sparse
+    with open(os.path.join(path, META_FILE), 'rb') as fh:
+        meta = pickle.load(fh)
+    stoich = sparse.load_npz(os.path.join(path, STOICH_FILE))
+    thermo = np.load(os.path.join(path, THERMO_FILE), mmap_mode='r')
+
+    # one column at a time, so only a single column is ever dense
+    stoich_df = pd.DataFrame(
+        {c: pd.arrays.SparseArray(stoich[:, [j]].toarray().ravel(),
+                                  fill_value=0)
+         for j, c in enumerate(meta['stoich_columns'])})
+    stoich_df.insert(0, 'formula', meta['stoich_formula'])
+
+    columns = dict(meta['thermo_strings'])
+    columns.update(zip(THERMO_NUMERIC, thermo))
+    thermo_df = pd.DataFrame(
+        {c: columns[c] for c in meta['thermo_columns']}, copy=False)
+    return stoich_df, thermo_df, meta['version']
+
+
+def use_shared(path=SHARED_DIR):
+    '''
+    Points alchemist.tools at the memory-mapped tables of an export.
+    '''
+    stoich_df, thermo_df, version = attach_tables(path)
+    tools.use_tables(stoich_df, thermo_df, version)
+
+
+def export_vectors(model, path=SHARED_DIR):
+    '''
+    Saves the word vectors of a gensim model (or a KeyedVectors) so that
+    attach_vectors can map them.
+    '''
+    os.makedirs(path, exist_ok=True)
+    getattr(model, 'wv', model).save(os.path.join(path, VECTORS_FILE))
+
+
+def attach_vectors(path=SHARED_DIR):
+    '''
+    --Output--
+    gensim.models.KeyedVectors
+        with the vector arrays memory-mapped read-only
+    '''
+    from gensim.models import KeyedVectors
+    return KeyedVectors.load(os.path.join(path, VECTORS_FILE), mmap='r')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='export the species tables (and word vectors) for '
+                    'memory-mapped loading')
+    parser.add_argument('--data-dir', default=tools.DATA_DIR)
+    parser.add_argument('--model', default=None,
+                        help='pickled gensim model whose vectors to export')
+    parser.add_argument('-o', '--out', default=SHARED_DIR)
+    args = parser.parse_args(argv)
+
+    tools.load_data(args.data_dir)
+    export_tables(tools.STOICH_DF, tools.THERMO_DF, tools.DATA_VERSION,
+                  args.out)
+    if args.model:
+        with open(args.model, 'rb') as fh:
+            export_vectors(pickle.load(fh), args.out)
+    print(f'exported data version {tools.DATA_VERSION} to {args.out}',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,25 @@
-from tika import parser                 # to initiate tika server
+import os
+import json
 import time
 import re
 
+from alchemist.files import content_hash, atomic_write
+
+# stop words on top of nltk's english list; publisher boilerplate and
+# textbook furniture
+EXTRA_STOP_WORDS = ['copyright', 'cengage', 'pearson', 'learning', 'may',
+                    'copied', 'scanned', 'duplicated', 'chapter', 'practice',
+                    'problem', 'exercise', 'review', 'question', 'figure',
+                    'follow']
+# lists every shard in a shard directory: {content hash: {source, paragraphs}}
+MANIFEST = 'manifest.json'
+
 def get_text(file, sleep=0, counter=0):
     if counter == 2:        # so we stop the recursive function
         pass
-    # grab the raw text using parser.from_file()
+    # grab the raw text using parser.from_file(); importing tika is slow and
+    # only needed here
+    from tika import parser                 # to initiate tika server
     raw = parser.from_file(file)
     status = raw['status']          # returns the status code from tika server
     # if things go well, return the raw text
@@ -42,4 +56,70 @@ def make_paragraphs(document, sleep=0):
 #     clean = re.sub('([A-Za-z]+)JJOOIINNPPAARRAAGGRRAAPPHH(.+)PPAARRAAGGRRAAPPHHJJOOIINN([a-z]+)', r'\1\3', clean)
     clean = re.split('PPAARRAAGGRRAAPPHH', clean)
     time.sleep(sleep)
-    return clean
\ No newline at end of file
+    return clean
+
+
+def stop_words():
+    from nltk.corpus import stopwords
+    return set(stopwords.words('english') + EXTRA_STOP_WORDS)
+
+
+def remove_stops(doc, stops):
+    # same tokens as notebook 01's CLEANER
+    from nltk.tokenize import word_tokenize
+    doc = word_tokenize(doc)
+    doc = [w.lower() for w in doc if not w in stops]
+    return [w for w in doc if w.isalpha()]
+
+
+def file_hash(file):
+    return content_hash([file])
+
+
+def read_manifest(shard_dir):
+    try:
+        with open(os.path.join(shard_dir, MANIFEST)) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def write_shards(files, shard_dir, stops=None):
+    # tokenizes each book once into shard_dir/<content hash>.txt, one
+    # paragraph per line, for alchemist.training to stream; books whose
+    # content is already sharded are skipped. returns the new hashes
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest = read_manifest(shard_dir)
+    stops = stop_words() if stops is None else stops
+    new = []
+    for file in files:
+        digest = file_hash(file)
+        if digest in manifest:
+            continue
+        paragraphs = 0
+        with atomic_write(os.path.join(shard_dir, f'{digest}.txt'), 'w',
+                          encoding='utf-8') as fh:
+            for paragraph in make_paragraphs(get_text(file)):
+                tokens = remove_stops(paragraph, stops)
+                if tokens:
+                    fh.write(' '.join(tokens) + '\n')
+                    paragraphs += 1
+        manifest[digest] = {'source': os.path.basename(file),
+                            'paragraphs': paragraphs}
+        # rewrite the manifest after every book, so an interrupted run
+        # resumes where it stopped
+        with atomic_write(os.path.join(shard_dir, MANIFEST), 'w') as fh:
+            json.dump(manifest, fh, indent=2)
+        new.append(digest)
+    return new
+
+
+if __name__ == '__main__':
+    # python -m alchemist.text ../data/external/texts/*.pdf -o shards/
+    import argparse
+    cli = argparse.ArgumentParser(
+        description='tokenize textbooks into paragraph shards')
+    cli.add_argument('files', nargs='+')
+    cli.add_argument('-o', '--out', default='./data/interim/shards/')
+    args = cli.parse_args()
+    print(f'{len(write_shards(args.files, args.out))} new shards')
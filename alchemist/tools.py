@@ -1,23 +1,691 @@
 import re
+import os
+import time
 import pickle
+import hashlib
+import functools
+import importlib
+import threading
+import weakref
 import numpy as np
-import pandas as pd
-import chemdataextractor as cde
-import pubchempy as pcp
 
-import sympy
 import itertools
-import operator
+from collections import namedtuple, OrderedDict
 
-from chempy import balance_stoichiometry
-from chempy import Substance
-from chempy import Reaction
-from chempy.util import periodic
+from alchemist import metrics
+from alchemist.files import content_hash
+from alchemist.cache import PredictionCache, ReactionNetwork, prediction_key
 
-STOICH_DF = pickle.load(open('./data/processed/stoich_df.p', 'rb'))
-THERMO_DF = pickle.load(open('./data/processed/thermo_df.p', 'rb'))
+# pandas, sympy, scipy, chempy, chemdataextractor and pubchempy take most of
+# a second to import, so functions import them when first needed; the old
+# module attributes still resolve, through __getattr__
+LAZY_ATTRIBUTES = {
+    'pd': ('pandas', None),
+    'cde': ('chemdataextractor', None),
+    'pcp': ('pubchempy', None),
+    'sympy': ('sympy', None),
+    'sparse': ('scipy.sparse', None),
+    'balance_stoichiometry': ('chempy', 'balance_stoichiometry'),
+    'Substance': ('chempy', 'Substance'),
+    'Reaction': ('chempy', 'Reaction'),
+    'periodic': ('chempy.util', 'periodic'),
+}
 
+DATA_DIR = './data/processed/'
+DATA_FILES = ['stoich_df.p', 'thermo_df.p']
+# reference temperature of the thermo table, in K
+STANDARD_T = 298.15
+# J mol-1 K-1
+GAS_CONSTANT = 8.314462618
+# candidate equations scored per matrix product in prediction_events
+ENERGY_BATCH = 64
+# columns of composition_matrix: charge (left empty) and Z = 1..118
+ELEMENT_COLUMNS = 119
+# columns of the screen_reactions table
+SCREEN_COLUMNS = ['reaction', 'products', 'delG', 'delH', 'delS', 'log_K',
+                  'spontaneous', 'T']
 
+# CONTEXT, and its parts as STOICH_DF, THERMO_DF and DATA_VERSION, are set
+# by use_tables; until then, the first function (or __getattr__ lookup) that
+# needs them calls load_data
+_LOAD_LOCK = threading.Lock()
+
+
+def __getattr__(name):
+    if name in ('CONTEXT', 'STOICH_DF', 'THERMO_DF', 'DATA_VERSION'):
+        _require_tables()
+        return globals()[name]
+    if name in LAZY_ATTRIBUTES:
+        module, attribute = LAZY_ATTRIBUTES[name]
+        value = importlib.import_module(module)
+        if attribute is not None:
+            value = getattr(value, attribute)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def _require_tables():
+    # load the processed pickles the first time a table is needed; the lock
+    # keeps concurrent first requests from loading them twice
+    if 'CONTEXT' not in globals():
+        with _LOAD_LOCK:
+            if 'CONTEXT' not in globals():
+                load_data()
+
+
+def _context(context):
+    return current_context() if context is None else context
+
+
+def data_version(files=DATA_FILES, data_dir=DATA_DIR):
+    '''
+    Hashes the contents of the processed data files, so anything cached
+    against the tables can tell when they have been rebuilt.
+
+    --Parameters--
+    files:          iterable (str)
+        file names inside data_dir
+
+    --Output--
+    str
+        first 16 hex digits of the sha1 digest
+    '''
+    return content_hash(os.path.join(data_dir, f) for f in files)
+
+
+# every Context alive, so that cached predictions of the versions still in
+# use survive use_context
+_CONTEXTS = weakref.WeakSet()
+
+
+class Context:
+    '''
+    An immutable snapshot of the stoich/thermo tables and their data
+    version. Every lookup memoized from the tables is kept with the context
+    it was computed from and dropped along with it, so a request keeps a
+    consistent view of the tables even if use_tables swaps in new ones
+    while it runs, and threads can share one context without locking. The
+    tables must not be modified in place.
+
+    The charge and element columns of stoich_df are kept as sparse columns
+    (see _sparse_elements): a species holds a few of the 118 elements, so
+    only its non-zero counts are stored.
+
+    --Parameters--
+    stoich_df:      DataFrame
+    thermo_df:      DataFrame
+        laid out like the processed pickles
+    version:        str or None
+        data version for cache keys; hashed from the tables as given if None
+
+    --Examples--
+    >>> context = Context(stoich_df, thermo_df)
+    >>> reaction_predictor(['Al', 'O2'], context=context)
+    4 Al + 3 O2 → 2 Al2O3
+    '''
+    __slots__ = ('stoich_df', 'thermo_df', 'version', '__weakref__')
+
+    def __init__(self, stoich_df, thermo_df, version=None):
+        if version is None:
+            version = hashlib.sha1(
+                pickle.dumps((stoich_df, thermo_df))).hexdigest()[:16]
+        object.__setattr__(self, 'stoich_df', _sparse_elements(stoich_df))
+        object.__setattr__(self, 'thermo_df', thermo_df)
+        object.__setattr__(self, 'version', version)
+        with _CONTEXT_CACHES_LOCK:
+            _CONTEXTS.add(self)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Context is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Context is immutable')
+
+    def __repr__(self):
+        return (f'Context(version={self.version!r}, '
+                f'species={len(self.thermo_df)})')
+
+
+def _sparse_elements(stoich_df):
+    # stoich_df with every numeric column stored sparse, filled with 0;
+    # returned as is if they already are
+    import pandas as pd
+    dense = [c for c, dtype in stoich_df.dtypes.items() if c != 'formula'
+             and not isinstance(dtype, pd.SparseDtype)]
+    if not dense:
+        return stoich_df
+    return stoich_df.astype({c: pd.SparseDtype(float, 0) for c in dense})
+
+
+def use_tables(stoich_df, thermo_df, version=None):
+    '''
+    Swaps in a different pair of stoich/thermo tables, e.g. a test fixture,
+    as the context functions use when they are not given one.
+
+    --Parameters--
+    stoich_df:      DataFrame
+    thermo_df:      DataFrame
+        laid out like the processed pickles
+    version:        str or None
+        data version for cache keys; hashed from the tables if None
+
+    --Output--
+    Context
+    '''
+    return use_context(Context(stoich_df, thermo_df, version))
+
+
+def use_context(context):
+    '''
+    Makes context the default for every function's context argument. Calls
+    already running finish on the context they started with; what was
+    memoized against it is dropped once nothing holds it any more, and
+    other contexts' lookups are left alone.
+
+    --Output--
+    Context
+    '''
+    global CONTEXT, STOICH_DF, THERMO_DF, DATA_VERSION
+    CONTEXT = context
+    STOICH_DF, THERMO_DF, DATA_VERSION = \
+        context.stoich_df, context.thermo_df, context.version
+    with _CONTEXT_CACHES_LOCK:
+        live = {c.version for c in _CONTEXTS}
+    PREDICTION_CACHE.set_version(context.version, live)
+    return context
+
+
+def current_context():
+    '''
+    --Output--
+    Context
+        the one set by the last use_tables or use_context, after loading
+        the processed pickles if nothing has been set yet
+    '''
+    _require_tables()
+    return CONTEXT
+
+
+def load_data(data_dir=DATA_DIR):
+    '''
+    Loads the processed stoich/thermo pickles from data_dir.
+    '''
+    with open(os.path.join(data_dir, 'stoich_df.p'), 'rb') as fh:
+        stoich_df = pickle.load(fh)
+    with open(os.path.join(data_dir, 'thermo_df.p'), 'rb') as fh:
+        thermo_df = pickle.load(fh)
+    use_tables(stoich_df, thermo_df, data_version(data_dir=data_dir))
+
+
+# what reaction_predictor(..., full_output=True) returns
+Prediction = namedtuple('Prediction', ['reaction', 'energy', 'exhaustive'])
+
+PREDICTION_CACHE = PredictionCache(os.path.join(DATA_DIR, 'predictions.db'))
+# precomputed reactions for small element systems; see alchemist.network
+NETWORK = ReactionNetwork(os.path.join(DATA_DIR, 'network.db'))
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=PREDICTION_CACHE.after_fork)
+    os.register_at_fork(after_in_child=NETWORK.after_fork)
+metrics.register_cache(
+    'predictions', lambda: (PREDICTION_CACHE.hits, PREDICTION_CACHE.misses))
+
+
+# {context: {function name: lru_cache}} for the _per_context functions; an
+# entry goes when its context does
+_CONTEXT_CACHES = weakref.WeakKeyDictionary()
+_CONTEXT_CACHES_LOCK = threading.RLock()
+# {function name: [hits, misses]} of caches already cleared or dropped
+_RETIRED_STATS = {}
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'contexts'])
+
+
+def _retire(caches):
+    # keeps the statistics of caches about to go, then empties them; also
+    # runs from the garbage collector, hence the reentrant lock
+    with _CONTEXT_CACHES_LOCK:
+        for name, cached in list(caches.items()):
+            info = cached.cache_info()
+            stats = _RETIRED_STATS.setdefault(name, [0, 0])
+            stats[0] += info.hits
+            stats[1] += info.misses
+            cached.cache_clear()
+
+
+def _per_context(maxsize=None):
+    # functools.lru_cache for functions of (context, *args), with a cache of
+    # their own in every context's _CONTEXT_CACHES entry. lookups on old
+    # tables can't outlive their context, even when calls still running on
+    # it fill them in after a swap. the cached function only holds a weak
+    # reference to the context, so the entry doesn't keep its own key alive
+    def decorator(fn):
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(context, *args, **kwargs):
+            caches = _CONTEXT_CACHES.get(context)
+            if caches is None:
+                with _CONTEXT_CACHES_LOCK:
+                    caches = _CONTEXT_CACHES.get(context)
+                    if caches is None:
+                        caches = _CONTEXT_CACHES[context] = {}
+                        weakref.finalize(
+                            context, _retire, caches).atexit = False
+            cached = caches.get(name)
+            if cached is None:
+                ref = weakref.ref(context)
+                cached = caches.setdefault(name, functools.lru_cache(maxsize)(
+                    lambda *args, **kwargs: fn(ref(), *args, **kwargs)))
+            return cached(*args, **kwargs)
+
+        def cache_info():
+            hits, misses = _RETIRED_STATS.get(name, (0, 0))
+            contexts = 0
+            for caches in list(_CONTEXT_CACHES.values()):
+                if name in caches:
+                    info = caches[name].cache_info()
+                    hits, misses = hits + info.hits, misses + info.misses
+                    contexts += 1
+            return CacheInfo(hits, misses, contexts)
+
+        def cache_clear(context=None):
+            with _CONTEXT_CACHES_LOCK:
+                entries = list(_CONTEXT_CACHES.items())
+            for c, caches in entries:
+                if (context is None or c is context) and name in caches:
+                    _retire({name: caches[name]})
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+def clear_caches(tables_only=False, context=None):
+    '''
+    Forgets memoized lookups. Call this after replacing the tables of a
+    context in place. Swapping in a new context doesn't need it: each
+    context has its own lookups.
+
+    --Parameters--
+    tables_only:    bool
+        keep the lookups that do not depend on the tables, such as balanced
+        equations
+    context:        Context or None
+        forget only the lookups made against this context; None forgets
+        those of every context
+    '''
+    for f in (_state, _thermo_index, _composition, _element_index,
+              _element_rows, _formula_index, _thermo_arrays, _thermo_at):
+        f.cache_clear(context)
+    if not tables_only:
+        for f in (_elements, _balance, _coefficients):
+            f.cache_clear()
+
+
+def preload(context=None):
+    '''
+    Loads the tables, builds every per-table index and imports the lazily
+    imported libraries, ahead of the first prediction. Call it before
+    forking workers, so that they share all of it copy-on-write instead of
+    each building their own.
+
+    --Parameters--
+    context:        Context or None
+        the context to preload; None preloads current_context()
+
+    --Output--
+    Context
+        the context preloaded
+    '''
+    for name in ('sympy', 'chempy', 'scipy.sparse'):
+        importlib.import_module(name)
+    context = _context(context)
+    for f in (_thermo_index, _thermo_arrays, _composition, _element_index,
+              _formula_index):
+        f(context)
+    return context
+
+
+@functools.lru_cache(maxsize=65536)
+def _balance(reactants, products):
+    # balancing is the slowest step of a prediction, and the same candidate
+    # equations come up again and again; failures are remembered as None
+    from chempy import balance_stoichiometry
+    try:
+        return balance_stoichiometry(reactants, products)
+    except:
+        return None
+
+
+@functools.lru_cache(maxsize=65536)
+def _coefficients(reactants, products):
+    # the balanced coefficients, reactants first, as plain numbers; None
+    # unless every one is a definite number >= 1. a fraction of the size of
+    # _balance's dicts of sympy numbers, so the search caches these instead
+    import sympy
+    balance = _balance.__wrapped__(reactants, products)
+    if balance is None:
+        return None
+    coefficients = []
+    for c in list(balance[0].values()) + list(balance[1].values()):
+        if not isinstance(c, (int, sympy.Number)) or c < 1:
+            return None
+        coefficients.append(
+            int(c) if isinstance(c, (int, sympy.Integer)) else float(c))
+    return tuple(coefficients)
+
+
+@functools.lru_cache(maxsize=None)
+def _elements(formula):
+    from chempy import Substance
+    return frozenset(Substance.from_formula(formula).composition)
+
+
+@_per_context()
+def _thermo_index(context):
+    # row positions in THERMO_DF by formula, with and without the state
+    exact, bare = {}, {}
+    for i, f in enumerate(context.thermo_df['formula']):
+        exact.setdefault(f, []).append(i)
+        bare.setdefault(formula_state_separator(f), []).append(i)
+    return exact, bare
+
+
+@_per_context()
+def _thermo_arrays(context):
+    return {c: context.thermo_df[c].to_numpy(dtype=float)
+            for c in ['G', 'H', 'S', 'Cp']}
+
+
+@_per_context(maxsize=64)
+def _thermo_at(context, energy, T):
+    # Cp is taken as constant over the range; species without a Cp get no
+    # heat capacity correction, species without an S get NaN away from
+    # STANDARD_T
+    arrays = _thermo_arrays(context)
+    G, H, S = arrays['G'], arrays['H'], arrays['S']
+    Cp = np.nan_to_num(arrays['Cp'])
+    if isinstance(T, tuple):
+        T = np.array(T)[:, None]
+    dT = T - STANDARD_T
+    log_ratio = np.log(T / STANDARD_T)
+    if energy == 'G':
+        values = G - S * dT + Cp * (dT - T * log_ratio)
+    elif energy == 'H':
+        values = H + Cp * dT
+    elif energy == 'S':
+        values = S + Cp * log_ratio
+    else:
+        raise ValueError(f"no temperature dependence for '{energy}'")
+    values.setflags(write=False)
+    return values
+
+
+def thermo_energies(energy='G', T=STANDARD_T, context=None):
+    '''
+    Evaluates G, H or S at temperature T for every species in THERMO_DF at
+    once, from the standard-state G, H, S and Cp columns.
+
+    G(T) = G - S (T - T0) + Cp (T - T0 - T ln(T / T0))
+    H(T) = H + Cp (T - T0)
+    S(T) = S + Cp ln(T / T0)
+
+    --Parameters--
+    energy:         str
+        'G', 'H' or 'S'
+    T:              float or iterable (float)
+        temperature(s) in K; results are cached per temperature
+
+    --Output--
+    numpy.ndarray
+        one value per THERMO_DF row, or a (len(T), rows) matrix for many T
+
+    --Examples--
+    >>> thermo_energies('G', 298.15)[:3]
+    array([      0.   , -586939.888, -110905.288])
+    '''
+    context = _context(context)
+    if np.ndim(T) == 0:
+        return _thermo_at(context, energy, float(T))
+    return _thermo_at(context, energy, tuple(float(t) for t in T))
+
+
+@_per_context()
+def _composition(context):
+    # read off the stored values of the sparse columns, never densified
+    from scipy import sparse
+    n = len(context.stoich_df)
+    charge = np.zeros(n)
+    # seeded with empty arrays, so that a table without elements still
+    # concatenates
+    rows, Z, counts = [np.zeros(0, int)], [np.zeros(0, int)], [np.zeros(0)]
+    for c in context.stoich_df.columns:
+        if c == 'formula':
+            continue
+        column = context.stoich_df[c].array
+        r = column.sp_index.to_int_index().indices
+        values = np.asarray(column.sp_values, dtype=float)
+        keep = values != 0
+        if int(c) == 0:
+            charge[r[keep]] += values[keep]
+        else:
+            rows.append(r[keep])
+            Z.append(np.full(keep.sum(), int(c)))
+            counts.append(values[keep])
+    matrix = sparse.csr_matrix(
+        (np.concatenate(counts), (np.concatenate(rows), np.concatenate(Z))),
+        shape=(n, ELEMENT_COLUMNS))
+    matrix.sort_indices()
+    # CSR keeps its arrays mutable; freeze them, since every caller shares
+    # this one matrix
+    for array in (matrix.data, matrix.indices, matrix.indptr, charge):
+        array.setflags(write=False)
+    return matrix, charge
+
+
+def composition_matrix(context=None):
+    '''
+    Returns the element counts of every STOICH_DF species as a sparse
+    matrix, with the charge kept apart, so that composition queries cost
+    time in proportion to the non-zero counts rather than to the width of
+    the periodic table.
+
+    --Output--
+    tuple
+        (species x ELEMENT_COLUMNS) scipy.sparse.csr_matrix with the count
+        of element Z in column Z (column 0 stays empty), and the charge of
+        each species as a numpy.ndarray; rows follow STOICH_DF
+
+    --Examples--
+    >>> matrix, charge = composition_matrix()
+    >>> matrix[STOICH_DF['formula'].tolist().index('CO3-2(aq)')].indices
+    array([6, 8], dtype=int32)
+    '''
+    return _composition(_context(context))
+
+
+def _indicator(elements):
+    vector = np.zeros(ELEMENT_COLUMNS)
+    vector[[int(z) for z in elements if z != 0]] = 1
+    return vector
+
+
+def element_coverage(elements, context=None):
+    '''
+    Counts, for every STOICH_DF species, how many of the given elements it
+    contains and how many other elements it contains.
+
+    --Parameters--
+    elements:       iterable (int)
+        atomic numbers; the charge pseudo-element 0 is ignored
+
+    --Output--
+    tuple (numpy.ndarray)
+        covered and other element counts, one entry per STOICH_DF row;
+        subsets of elements have no others, supersets cover them all
+
+    --Examples--
+    >>> covered, other = element_coverage({1, 8})
+    >>> STOICH_DF['formula'][(covered == 2) & (other == 0)].tolist()
+    ['H2O(l)', 'H2O(g)', 'OH-(aq)', ...]
+    '''
+    matrix, _ = composition_matrix(context)
+    present = matrix.astype(bool).astype(float)
+    covered = present @ _indicator(elements)
+    other = np.diff(matrix.indptr) - covered
+    return covered.astype(int), other.astype(int)
+
+
+def _count_rows(context, rows, composition):
+    # the rows, among these, with the given count of every element in
+    # composition, and the given charge if composition has one
+    rows = np.asarray(rows, dtype=int)
+    if not len(rows):
+        return rows
+    matrix, charge = composition_matrix(context)
+    keep = np.ones(len(rows), dtype=bool)
+    Z = [int(z) for z in composition if z != 0]
+    if Z:
+        counts = matrix[rows][:, Z].toarray()
+        keep &= (counts == [composition[z] for z in Z]).all(axis=1)
+    if 0 in composition:
+        keep &= charge[rows] == composition[0]
+    return rows[keep]
+
+
+def species_by_composition(formula, charge=True, context=None):
+    '''
+    Finds the species with exactly the composition of a formula, whatever
+    the order its elements are written in.
+
+    --Parameters--
+    formula:        str
+        a string of a single chemical formula; a state is ignored
+    charge:         bool
+        also require the same charge; neutral formulas then only match
+        neutral species
+
+    --Output--
+    list (str)
+
+    --Examples--
+    >>> species_by_composition('ClNa')
+    ['NaCl(s)', 'NaCl(aq)']
+    '''
+    from chempy import Substance
+    context = _context(context)
+    composition = dict(Substance.from_formula(formula).composition)
+    if charge:
+        composition.setdefault(0, 0)
+    else:
+        composition.pop(0, None)
+    rows = _element_rows(context, frozenset(composition) - {0}, 'exact')
+    rows = _count_rows(context, rows, composition)
+    return list(context.stoich_df['formula'].iloc[rows])
+
+
+def element_mask(elements):
+    '''
+    Packs a set of atomic numbers into an int with bit Z set for each
+    element. The charge pseudo-element 0 is ignored.
+
+    --Examples--
+    >>> element_mask({1, 8})
+    258
+    '''
+    mask = 0
+    for z in elements:
+        if z != 0:
+            mask |= 1 << int(z)
+    return mask
+
+
+@_per_context()
+def _element_index(context):
+    # row positions in STOICH_DF bucketed by element mask; rows with neither
+    # elements nor charge are left out
+    matrix, charge = composition_matrix(context)
+    buckets = {}
+    for i in range(matrix.shape[0]):
+        Z = matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+        if len(Z) or charge[i]:
+            buckets.setdefault(element_mask(Z), []).append(i)
+    index = {}
+    for key, rows in buckets.items():
+        index[key] = np.array(rows)
+        index[key].setflags(write=False)
+    return index
+
+
+def _submasks(mask):
+    sub = mask
+    while True:
+        yield sub
+        if sub == 0:
+            return
+        sub = (sub - 1) & mask
+
+
+@_per_context()
+def _element_rows(context, elements, match='subset'):
+    # row positions in STOICH_DF, in table order, of species whose element
+    # set is a subset of, a superset of or exactly these elements
+    index = _element_index(context)
+    query = element_mask(elements)
+    if match == 'exact':
+        keys = [query] if query in index else []
+    elif match == 'superset':
+        keys = [k for k in index if k & query == query]
+    elif match == 'subset':
+        # walk the 2**n submasks of small queries instead of every bucket
+        if 1 << bin(query).count('1') <= len(index):
+            keys = [k for k in _submasks(query) if k in index]
+        else:
+            keys = [k for k in index if k & ~query == 0]
+    else:
+        raise ValueError(f"unknown match '{match}'")
+    if not keys:
+        rows = np.array([], dtype=int)
+    else:
+        rows = np.sort(np.concatenate([index[k] for k in keys]))
+    rows.setflags(write=False)
+    return rows
+
+
+def species_by_elements(elements, match='subset', context=None):
+    '''
+    Looks up species by their element set through an inverted index, so the
+    cost follows the number of matches rather than the size of STOICH_DF.
+
+    --Parameters--
+    elements:       iterable (int or str)
+        atomic numbers, or formulas whose elements are used
+    match:          str
+        'subset' for species made only of these elements, 'superset' for
+        species containing all of them, 'exact' for species made of exactly
+        these elements
+
+    --Output--
+    list (str)
+
+    --Examples--
+    >>> species_by_elements(['NaCl'], match='exact')
+    ['NaCl(s)', 'NaCl(aq)']
+
+    >>> species_by_elements({11, 8}, match='superset')
+    ['NaAlO2(s)', 'NaOH(s)', 'NaOH(aq)', 'Na2O(s)', 'Na2O2(s)', 'Na2CO3(s)']
+    '''
+    context = _context(context)
+    elements = list(elements)
+    if elements and isinstance(elements[0], str):
+        elements = Z_unique(elements)
+    rows = _element_rows(context, frozenset(elements) - {0}, match)
+    return list(context.stoich_df['formula'].iloc[rows])
+
+
+@metrics.timed
 def check_coefficients(reactants, products):
     '''
     Checks whether a possible reactant/product combination would result in a
@@ -42,20 +710,12 @@ def check_coefficients(reactants, products):
     False
     '''
     try:
-        balance = balance_stoichiometry(reactants, products)
-        # list all the coefficients out
-        reac_coef = list(balance[0].values()) + list(balance[1].values())
-        # rounds to zero if any of the coefficients are less than 1
-        is_positive = np.floor((np.array(reac_coef) >= 1).mean()).astype(bool)
-        # rounds to zero if any of the coefficients are sympy relational class
-        is_definite = np.floor(
-            np.array([isinstance(i, sympy.numbers.Number) for i in reac_coef])
-            .mean()).astype(bool)
-        return is_positive and is_definite
+        return _coefficients(tuple(reactants), tuple(products)) is not None
     except:
         return False
 
 
+@metrics.timed
 def Z_unique(substances):
     '''
     Returns a set representing unique atomic numbers present within a list of
@@ -75,11 +735,10 @@ def Z_unique(substances):
     '''
     if type(substances) == str:
         substances = [substances]
-    composition = []
+    composition = set()
     for s in substances:
-        sub = Substance.from_formula(s)
-        composition += [*sub.composition]
-    return set(composition)
+        composition |= _elements(s)
+    return composition
 
 
 def formula_state_separator(formula, keep_state=False):
@@ -112,13 +771,16 @@ def formula_state_separator(formula, keep_state=False):
         return formula
 
 
-def get_gibbs(formula, energy='G', df=False):
+@metrics.timed
+def get_gibbs(formula, energy='G', df=False, T=None, context=None):
     '''
     Retrieves the free energy value, in J, of a single substance
     
     --Parameters--
     formula:        str
         a string of a single chemical formula
+    T:              float, iterable (float) or None
+        temperature in K for 'G', 'H' and 'S'; None reads the table as is
     
     --Output--
     list (float)    
@@ -126,28 +788,38 @@ def get_gibbs(formula, energy='G', df=False):
     --Examples--
     >>> get_gibbs('NaCl(aq)')
     array([-388735.44])
+
+    >>> get_gibbs('H2O(l)', T=373.15)
+    -243080.44
     '''
-    if (THERMO_DF['formula'] == formula).max():
-        matches = THERMO_DF[THERMO_DF['formula'] == formula]
-    else:
-        matches = THERMO_DF[THERMO_DF['formula'].map(
-            lambda x: x[:len(formula)] == formula)]
-        matches = matches[matches['formula'].map(
-            formula_state_separator) == formula]
+    # exact matches win; otherwise take every state of the bare formula
+    context = _context(context)
+    exact, bare = _thermo_index(context)
+    rows = exact.get(formula) or bare.get(formula, [])
 
     if df:
+        matches = context.thermo_df.iloc[rows]
+        if T is not None:
+            matches = matches.copy()
+            for c in ['G', 'H', 'S']:
+                matches[c] = thermo_energies(c, T, context)[rows]
         return matches
+    elif T is not None and energy in ('G', 'H', 'S'):
+        return thermo_energies(energy, T, context)[..., rows[0]]
     else:
-        return list(matches[energy])[0]
+        return context.thermo_df[energy].iat[rows[0]]
 
 
-def state_predictor(formula):
+@metrics.timed
+def state_predictor(formula, T=None, context=None):
     '''
     Predicts the state of the substance under standard conditions
 
     --Parameters--
     formula:        str
         a string of a single chemical formula
+    T:              float or None
+        temperature in K; None uses the standard-state G column
 
     --Output--
     str
@@ -158,12 +830,22 @@ def state_predictor(formula):
 
     >>> state_predictor('CO2')
     CO2(g)
+
+    >>> state_predictor('H2O', T=400)
+    H2O(g)
     '''
-    df = get_gibbs(formula, df=True)
+    return _state(_context(context), formula, T)
+
+
+@_per_context()
+def _state(context, formula, T):
+    df = get_gibbs(formula, df=True, T=T, context=context)
     return list(df.sort_values(by='G')['formula'])[0]
 
 
-def stoich_filter(substances, df=False, thorough=False, exact=False):
+@metrics.timed
+def stoich_filter(substances, df=False, thorough=False, exact=False, T=None,
+                  context=None):
     '''
     Returns a masked copy of the stoich dataframe containing elements that
     only contain the elements present in substances. 
@@ -171,9 +853,13 @@ def stoich_filter(substances, df=False, thorough=False, exact=False):
     --Parameters--
     substances:     iterable (str)
         any iterable containing strings with valid chemical formulas
+    T:              float or None
+        temperature in K used to pick each species' state
     
     --Output--
     DataFrame or list (str)
+        with df, the matching STOICH_DF rows and columns, element counts
+        in sparse columns
 
     --Examples--
     >>> stoich_filter('CO2(g)')
@@ -185,42 +871,54 @@ def stoich_filter(substances, df=False, thorough=False, exact=False):
     if type(substances) == str:
         substances = [substances]
 
-    stoich_temp = STOICH_DF.copy()
+    context = _context(context)
+    elements = Z_unique(substances)
 
     # mask to keep the charge and formula columns in final dataframe
-    z_keep = [0, 'formula'] + list(Z_unique(substances))
-
-    # get all other columns
-    column_mask = [col for col in stoich_temp.columns if col not in z_keep]
-    for col in column_mask:
-        # return the dataframe where these columns are all 0
-        stoich_temp = stoich_temp[stoich_temp[col] == 0]
-
-    # keep the columns where it's not all zero
-    stoich_temp = stoich_temp.loc[(stoich_temp.drop(
-        columns=['formula']) != 0).any(axis=1)]
+    z_keep = [0, 'formula'] + list(elements)
 
+    # species with no other elements, and not all zero; the row positions
+    # come from the element index
     if exact:
+        from chempy import Substance
         thorough = True
         substance = Substance.from_formula(substances[0])
         composition = substance.composition
-        for z in list(composition.keys()):
-            stoich_temp = stoich_temp[stoich_temp[z] == composition[z]]
+        # with a single substance only its own element set can match
+        own = frozenset(composition) - {0}
+        match = 'exact' if own == frozenset(elements) - {0} else 'subset'
+        rows = _element_rows(context, frozenset(elements) - {0}, match)
+        rows = _count_rows(context, rows, composition)
+    else:
+        rows = _element_rows(context, frozenset(elements) - {0})
 
-    # return the dataframe with the columns we want to keep
+    # return the dataframe with the columns we want to keep; only those
+    # columns are sliced, since slicing a sparse column isn't free
     if df:
-        return stoich_temp[z_keep]
+        return context.stoich_df[z_keep].iloc[rows]
     else:
-        stoich_list = list(stoich_temp['formula'])
+        stoich_list = list(context.stoich_df['formula'].iloc[rows])
         if thorough:
             return [f for f in stoich_list]
         else:
-            stoich_list = [formula_state_separator(f) for f in stoich_list]
-            substances = [formula_state_separator(s) for s in substances]
-            return set([state_predictor(f) for f in stoich_list if f not in substances])
+            return _stable_states(context, stoich_list, substances, T)
 
 
-def formula_rearranger(formula):
+def _stable_states(context, formulas, substances, T, expired=lambda: False):
+    # the predicted state of every formula that isn't one of substances, as
+    # stoich_filter returns them; stops early once expired() turns true
+    formulas = [formula_state_separator(f) for f in formulas]
+    substances = [formula_state_separator(s) for s in substances]
+    states = set()
+    for f in formulas:
+        if expired():
+            break
+        if f not in substances:
+            states.add(state_predictor(f, T, context))
+    return states
+
+
+def formula_rearranger(formula, context=None):
     '''
     (maybe?) fixes the order of elements listed in a chemical formula.
     
@@ -238,38 +936,73 @@ def formula_rearranger(formula):
     >>> formula_rearranger('BaO4S')
     BaSO4
     '''
-    # https://stackoverflow.com/questions/1518522/
-    def most_common(L):
-        # get an iterable of (item, iterable) pairs
-        SL = sorted((x, i) for i, x in enumerate(L))
-        # print 'SL:', SL
-        groups = itertools.groupby(SL, key=operator.itemgetter(0))
-        # auxiliary function to get "quality" for an item
-        def _auxfun(g):
-            item, iterable = g
-            count = 0
-            min_index = len(L)
-            for _, where in iterable:
-                count += 1
-                min_index = min(min_index, where)
-            # print 'item %r, count %r, minind %r' % (item, count, min_index)
-            return count, -min_index
-    # pick the highest-count/earliest item
-        return max(groups, key=_auxfun)[0]
-
-    if formula in list(THERMO_DF['formula']):
-        return formula
-    elif formula in list(THERMO_DF['abbrv']):
+    known, by_charge, by_elements = _formula_index(_context(context))
+    if formula in known:
         return formula
-    elif formula in list(THERMO_DF['formula'].apply(formula_state_separator)):
-        return formula
-    else:
-        formulas = stoich_filter(formula, exact=True)
-        formulas = [formula_state_separator(f) for f in formulas]
-        return most_common(formulas)
+    # neutral input matches species of any charge
+    key = composition_key(formula)
+    preferred = by_charge if key and key[0][0] == 0 else by_elements
+    if key not in preferred:
+        raise ValueError(f"no species with the composition of '{formula}'")
+    return preferred[key]
+
+
+def composition_key(formula, charge=True):
+    '''
+    Returns a canonical, order-independent key for a formula's composition.
+
+    --Parameters--
+    formula:        str
+        a string of a single chemical formula
+    charge:         bool
+        include the charge as a (0, charge) entry when it is not zero
+
+    --Output--
+    tuple (tuple)
+        sorted (Z, count) pairs
+
+    --Examples--
+    >>> composition_key('ClNa') == composition_key('NaCl(aq)')
+    True
+
+    >>> composition_key('CO3-2')
+    ((0, -2.0), (6, 1.0), (8, 3.0))
+    '''
+    from chempy import Substance
+    composition = Substance.from_formula(formula).composition
+    return tuple(sorted((int(z), float(n)) for z, n in composition.items()
+                        if n and (charge or z != 0)))
+
+
+@_per_context()
+def _formula_index(context):
+    # formulas as written in the tables, and the preferred formula for each
+    # composition: the bare formula shared by the most species, earliest in
+    # STOICH_DF on ties
+    thermo_df = context.thermo_df
+    known = set(thermo_df['formula']) | set(thermo_df['abbrv'].dropna())
+    known |= {formula_state_separator(f) for f in thermo_df['formula']}
+
+    matrix, charge = composition_matrix(context)
+    groups = ({}, {})
+    for i, formula in enumerate(context.stoich_df['formula']):
+        span = slice(matrix.indptr[i], matrix.indptr[i + 1])
+        neutral = tuple(zip(matrix.indices[span].tolist(),
+                            matrix.data[span].tolist()))
+        pairs = ((0, float(charge[i])),) + neutral if charge[i] else neutral
+        bare = formula_state_separator(formula)
+        for group, key in zip(groups, (pairs, neutral)):
+            counts = group.setdefault(key, {})
+            counts[bare] = counts.get(bare, 0) + 1
+
+    # dicts keep insertion order, so max keeps the earliest on ties
+    by_charge, by_elements = (
+        {key: max(counts, key=counts.get) for key, counts in group.items()}
+        for group in groups)
+    return known, by_charge, by_elements
 
 
-def formula_from_name(name):
+def formula_from_name(name, context=None):
     '''
     Requests formula from pubchem from a name.
     
@@ -287,8 +1020,10 @@ def formula_from_name(name):
     >>> formula_rearranger('titanium dioxide')
     TiO2
     '''
-    names = list(THERMO_DF['name'])
-    nicknames = list(THERMO_DF['abbrv'])
+    import pubchempy as pcp
+    context = _context(context)
+    names = list(context.thermo_df['name'])
+    nicknames = list(context.thermo_df['abbrv'])
 
     target = []
     for n in names:
@@ -305,28 +1040,41 @@ def formula_from_name(name):
 
     formulas = pcp.get_compounds(name, 'name', listkey_count=1)
     formula = formulas[0].molecular_formula
-    formula = formula_rearranger(formula)
+    formula = formula_rearranger(formula, context)
     return formula
 
 
-def standard_gibbs_free_energy(reactants, products, kJ=True):
+@metrics.timed
+def standard_gibbs_free_energy(reactants, products, kJ=True, T=None,
+                               context=None):
     '''
     Returns the overall delG of a reaction under standard conditions. 
     
     --Parameters--
     reactants:      iterable (str)
     products:       iterable (str)
+    T:              float, iterable (float) or None
+        temperature in K; a sequence evaluates a whole temperature sweep with
+        one matrix per species lookup, keeping the states found at
+        STANDARD_T
     
     --Output--
-    float
+    float, or numpy.ndarray for a sweep
         
     --Examples--
     >>> standard_gibbs_free_energy(['Na', 'H2O'], ['NaH', 'O2'])
     340.36
+
+    >>> standard_gibbs_free_energy(['H2O(l)'], ['H2O(g)'], T=[298.15, 400])
+    array([ 8.56, -2.9 ])
     '''
-    products = [state_predictor(p) for p in products]
-    reactants = [state_predictor(r) for r in reactants]
-    equation = balance_stoichiometry(reactants, products)
+    context = _context(context)
+    state_T = T if np.ndim(T) == 0 else None
+    products = [state_predictor(p, state_T, context) for p in products]
+    reactants = [state_predictor(r, state_T, context) for r in reactants]
+    equation = _balance(tuple(reactants), tuple(products))
+    if equation is None:
+        raise ValueError(f'cannot balance {reactants} -> {products}')
     # each side is a formula, coefficient tuple
     prod = list(equation[1].items())
     reac = list(equation[0].items())
@@ -337,14 +1085,358 @@ def standard_gibbs_free_energy(reactants, products, kJ=True):
     def gibbs_sum(side):
         interim_delG = 0
         for s in side:
-            interim_delG += get_gibbs(s[0]) * s[1]
+            interim_delG += get_gibbs(s[0], T=T, context=context) * \
+                float(s[1])
         return interim_delG
 
     delG = gibbs_sum(prod) - gibbs_sum(reac)
+    if np.ndim(delG) == 0:
+        delG = float(delG)
     return delG / (1 + 999*kJ)
 
 
-def reaction_predictor(reactants, max_length=12):
+def _species_row(context, formula):
+    # the THERMO_DF row get_gibbs(formula) reads from
+    exact, bare = _thermo_index(context)
+    return (exact.get(formula) or bare[formula])[0]
+
+
+def coefficient_matrix(equations, context=None):
+    '''
+    Stacks balanced equations into a sparse (equations x THERMO_DF rows)
+    matrix: products count positive, reactants negative.
+
+    --Parameters--
+    equations:      iterable
+        chempy Reactions or (reactants, products) coefficient dict pairs, as
+        returned by balance_stoichiometry; formulas must carry their states
+
+    --Output--
+    scipy.sparse.csr_matrix
+    '''
+    from chempy import Reaction
+    from scipy import sparse
+    context = _context(context)
+    equations = list(equations)
+    data, rows, cols = [], [], []
+    for i, equation in enumerate(equations):
+        if isinstance(equation, Reaction):
+            equation = equation.reac, equation.prod
+        for side, sign in zip(equation, (-1, 1)):
+            for formula, coef in side.items():
+                data.append(sign * float(coef))
+                rows.append(i)
+                cols.append(_species_row(context, formula))
+    return sparse.csr_matrix(
+        (data, (rows, cols)),
+        shape=(len(equations), len(context.thermo_df)))
+
+
+def _candidate_matrix(context, species, coefficients):
+    # coefficient_matrix for equations already held as THERMO_DF rows and
+    # signed coefficients, skipping the formula lookups
+    from scipy import sparse
+    rows = np.repeat(np.arange(len(species)), [len(s) for s in species])
+    return sparse.csr_matrix(
+        (np.concatenate(coefficients), (rows, np.concatenate(species))),
+        shape=(len(species), len(context.thermo_df)))
+
+
+def _reaction(reactants, products, coefficients):
+    # a chempy Reaction from _coefficients output
+    from chempy import Reaction
+    n = len(reactants)
+    return Reaction(OrderedDict(zip(reactants, coefficients[:n])),
+                    OrderedDict(zip(products, coefficients[n:])))
+
+
+def reaction_energies(equations, energy='G', kJ=True, T=None, context=None):
+    '''
+    Returns delG (or delH, delS) of many balanced equations at once, as one
+    sparse matrix-vector product against the thermo table.
+
+    --Parameters--
+    equations:      iterable
+        see coefficient_matrix, or a coefficient matrix itself
+    energy:         str
+        'G', 'H' or 'S'
+    kJ:             bool
+        divide by 1000 (kJ mol-1, or kJ mol-1 K-1 for 'S')
+    T:              float, iterable (float) or None
+        temperature in K; see thermo_energies
+
+    --Output--
+    numpy.ndarray
+        one value per equation, or (equations, len(T)) for many T
+
+    --Examples--
+    >>> reaction_energies([balance_stoichiometry(['Al(s)', 'O2(g)'],
+    ...                                          ['Al2O3(s)'])])
+    array([-3164.6])
+
+    >>> reaction_energies([({'H2O(l)': 1}, {'H2O(g)': 1})], 'S', kJ=False)
+    array([118.9])
+    '''
+    from scipy import sparse
+    context = _context(context)
+    if not sparse.issparse(equations):
+        equations = coefficient_matrix(equations, context)
+    if T is None:
+        values = _thermo_arrays(context)[energy]
+    else:
+        values = thermo_energies(energy, T, context).T
+    return (equations @ values) / (1 + 999*kJ)
+
+
+def _rank(possibilities, max_length, T, context, expired=lambda: False):
+    # energy per unit mass ranks how favourable each product is; keeps the
+    # max_length most favourable. if expired() turns true, only the
+    # possibilities ranked by then are kept
+    specific = []
+    for s in possibilities:
+        if expired():
+            break
+        specific.append(get_gibbs(s, 'G', T=T, context=context) /
+                        get_gibbs(s, 'mass', context=context))
+    possibilities = possibilities[:len(specific)]
+    specific = np.array(specific)
+    if len(possibilities) > max_length:
+        indices = specific.argsort()[:max_length]
+        possibilities, specific = possibilities[indices], specific[indices]
+    return possibilities, specific
+
+
+def _enumerate(reactants, possibilities, specific, expired=lambda: False):
+    # product sets holding exactly the reactants' elements, as one row of
+    # indices into possibilities per candidate, padded with -1, lowest mean
+    # G / mass first; also how many sets were tried, and whether all of them
+    # were before expired() turned true.
+    # element sets as bitmasks, with the charge as bit 0
+    target = sum(1 << z for z in Z_unique(reactants))
+    elements = [sum(1 << z for z in Z_unique([p])) for p in possibilities]
+    combinations = []
+    enumerated = 0
+    exhaustive = True
+    comb_length = min(6, len(reactants) + 3)
+    for i in range(1, comb_length):
+        for c in itertools.combinations(range(len(possibilities)), i):
+            enumerated += 1
+            union = 0
+            for j in c:
+                union |= elements[j]
+            if union == target:
+                combinations.append(c)
+        if expired():
+            exhaustive = False
+            break
+    candidates = np.full(
+        (len(combinations), comb_length - 1), -1, dtype=np.int16)
+    for row, c in zip(candidates, combinations):
+        row[:len(c)] = c
+    mean_score = np.nanmean(
+        np.append(specific, np.nan)[candidates], axis=1)
+    candidates = candidates[np.argsort(mean_score, kind='stable')]
+    return candidates, enumerated, exhaustive
+
+
+def _search(context, reactants, max_length, T, energies='G',
+            expired=lambda: False):
+    # the candidate search behind prediction_events and screen_reactions.
+    # yields the 'scoping' and 'combining' events, then a 'batch' event per
+    # ENERGY_BATCH candidates with the products of those that balanced, how
+    # many candidates had been tried at each, and their energies (J mol-1,
+    # one column per letter of energies), and last 'searched', with whether
+    # every candidate was tried before expired() turned true
+    with metrics.timer('stage.filter'):
+        possibilities = np.array(sorted(_stable_states(
+            context, stoich_filter(reactants, thorough=True, context=context),
+            reactants, T, expired)))
+    metrics.count('candidates.species', len(possibilities))
+    yield {'stage': 'scoping', 'possibilities': len(possibilities)}
+    if expired():
+        yield {'stage': 'searched', 'exhaustive': False}
+        return
+    with metrics.timer('stage.rank'):
+        possibilities, specific = _rank(
+            possibilities, max_length, T, context, expired)
+    metrics.count('candidates.species_kept', len(possibilities))
+    if expired():
+        yield {'stage': 'searched', 'exhaustive': False}
+        return
+
+    with metrics.timer('stage.enumerate'):
+        candidates, enumerated, exhaustive = _enumerate(
+            reactants, possibilities, specific, expired)
+    metrics.count('candidates.combinations', enumerated)
+    metrics.count('candidates.combinations_kept', len(candidates))
+    yield {'stage': 'combining', 'possibilities': [str(p) for p in possibilities],
+           'combinations': len(candidates)}
+
+    # balance candidates a batch at a time and score each batch with one
+    # matrix product, so the best reaction so far is always close at hand.
+    # balanced candidates stay as THERMO_DF rows and integer coefficients
+    # until the caller picks the ones it turns into chempy Reactions
+    if T is None:
+        arrays = _thermo_arrays(context)
+        values = np.column_stack([arrays[e] for e in energies])
+    else:
+        values = np.column_stack(
+            [thermo_energies(e, T, context) for e in energies])
+    names = [str(p) for p in possibilities]
+    reactant_rows = [_species_row(context, r) for r in reactants]
+    product_rows = [_species_row(context, p) for p in names]
+
+    def products(candidate):
+        return tuple(names[j] for j in candidate if j >= 0)
+
+    for first in range(0, len(candidates), ENERGY_BATCH):
+        balanced, species, coefficients = [], [], []
+        for i in range(first, min(first + ENERGY_BATCH, len(candidates))):
+            if expired():
+                exhaustive = False
+                break
+            with metrics.timer('stage.balance'):
+                coefs = _coefficients(reactants, products(candidates[i]))
+            if coefs is not None:
+                balanced.append(i)
+                species.append(reactant_rows + [
+                    product_rows[j] for j in candidates[i] if j >= 0])
+                coefficients.append(np.array(coefs, dtype=float))
+                coefficients[-1][:len(reactants)] *= -1
+        metrics.count('candidates.balanced', len(balanced))
+        if balanced:
+            with metrics.timer('stage.energy'):
+                batch = _candidate_matrix(
+                    context, species, coefficients) @ values
+            yield {'stage': 'batch',
+                   'products': [products(candidates[i]) for i in balanced],
+                   'evaluated': [i + 1 for i in balanced],
+                   'energies': batch}
+        if not exhaustive:
+            break
+    yield {'stage': 'searched', 'exhaustive': exhaustive}
+
+
+def prediction_events(reactants, max_length=12, cache=True, deadline_ms=None,
+                      T=None, context=None):
+    '''
+    Runs the reaction_predictor search step by step, yielding a progress
+    event at each stage and whenever a better reaction turns up.
+
+    Candidate product sets are tried in order of their mean G / mass, so the
+    lowest-energy reactions tend to be found first. A search cut short by
+    deadline_ms returns the best reaction balanced so far, which can be well
+    short of the exhaustive answer.
+
+    The clock is checked between species while filtering and ranking, during
+    enumeration and before every balance. A single balance (one sympy solve)
+    can't be interrupted, so it is the granularity of the limit: the search
+    can overrun deadline_ms by one balance, plus what runs before the clock
+    is first checked: the reactants' states, the cache lookups and, on a
+    first call, the chempy import and the table's element index.
+
+    --Parameters--
+    reactants:      iterable(str)
+        any iterable containing strings with valid chemical formulas
+    cache:          bool
+        reuse results from PREDICTION_CACHE or the precomputed NETWORK, and
+        store new ones in PREDICTION_CACHE; only exhaustive searches are
+        stored
+    deadline_ms:    float or None
+        stop looking for better candidates after this many milliseconds;
+        see above for how closely it is kept
+    T:              float or None
+        temperature in K for states and energies; None is standard state
+    context:        Context or None
+        tables to search; None uses current_context()
+
+    --Output--
+    generator (dict)
+        every event has a 'stage' key:
+        'scoping'       possibilities (int)
+        'combining'     possibilities (list), combinations (int)
+        'best'          reaction, energy (kJ mol-1), evaluated, total
+        'done'          reaction, energy, cached (bool), exhaustive (bool);
+                        reaction is None when nothing balanced in time
+
+    --Examples--
+    >>> [e['stage'] for e in prediction_events(['Al', 'O2'])]
+    ['scoping', 'combining', 'best', 'done']
+    '''
+    start = time.perf_counter()
+    context = _context(context)
+
+    def expired():
+        return deadline_ms is not None and \
+            (time.perf_counter() - start) * 1000 > deadline_ms
+
+    reactants = [state_predictor(r, T, context) for r in reactants]
+    key = prediction_key(reactants, max_length, context.version, T)
+    if cache:
+        cached = PREDICTION_CACHE.get(key)
+        # the network is built under standard conditions only
+        if cached is None and T is None:
+            cached = NETWORK.lookup(
+                reactants, Z_unique(reactants), max_length, context.version)
+            metrics.count('network.hits', cached is not None)
+        if cached is not None:
+            yield {'stage': 'done', 'reaction': cached[0],
+                   'energy': cached[1], 'cached': True, 'exhaustive': True}
+            return
+
+    reactants = tuple(reactants)
+    best_energy, best = None, None
+    for event in _search(context, reactants, max_length, T, 'G', expired):
+        if event['stage'] == 'combining':
+            total = event['combinations']
+        if event['stage'] == 'batch':
+            for i, chosen, energy in zip(event['evaluated'],
+                                         event['products'],
+                                         event['energies'][:, 0] / 1000):
+                if best_energy is None or energy < best_energy:
+                    best_energy, best = float(energy), chosen
+                    yield {'stage': 'best',
+                           'reaction': _reaction(reactants, best,
+                                                 _coefficients(reactants, best)),
+                           'energy': best_energy,
+                           'evaluated': i, 'total': total}
+        elif event['stage'] == 'searched':
+            exhaustive = event['exhaustive']
+        else:
+            yield event
+
+    best_reaction = None
+    if best is not None:
+        best_reaction = _reaction(reactants, best,
+                                  _coefficients(reactants, best))
+        if cache and exhaustive:
+            PREDICTION_CACHE.set(key, best_reaction, best_energy,
+                                 context.version)
+    yield {'stage': 'done', 'reaction': best_reaction, 'energy': best_energy,
+           'cached': False, 'exhaustive': exhaustive}
+
+
+def print_event(event):
+    '''
+    Prints a prediction_events event as a one-line progress banner; pass it as
+    reaction_predictor's callback to follow a search interactively.
+    '''
+    stage = event['stage']
+    if stage == 'scoping':
+        print(f"scoping {event['possibilities']} possibilities...")
+    elif stage == 'combining':
+        print(f"  optimizing {event['combinations']} combinations...")
+    elif stage == 'best':
+        print(f"    {event['evaluated']}/{event['total']}: "
+              f"{event['reaction']} ({event['energy']:.4} kJ mol-1)")
+    elif stage == 'done' and event['reaction'] is not None:
+        print(event['reaction'])
+        print(f"delG = {event['energy']:.4} kJ mol-1")
+
+
+def reaction_predictor(reactants, max_length=12, cache=True, callback=None,
+                       deadline_ms=None, full_output=False, T=None,
+                       context=None):
     '''
     Returns the balanced chemical equation of the predicted reaction based on
     minimizing overall delG values.
@@ -352,52 +1444,101 @@ def reaction_predictor(reactants, max_length=12):
     --Parameters--
     reactants:      iterable(str)
         any iterable containing strings with valid chemical formulas
+    cache:          bool
+        reuse (and store) results in PREDICTION_CACHE; repeat queries for the
+        same reactants skip the whole search
+    callback:       callable or None
+        called with every event from prediction_events, e.g. print_event
+    deadline_ms:    float or None
+        return the best reaction found within this many milliseconds; it can
+        be overrun by one balance, see prediction_events
+    full_output:    bool
+        return a Prediction instead of just the reaction
+    T:              float or None
+        temperature in K; None predicts under standard conditions
+    context:        Context or None
+        tables to predict from; None uses current_context()
     
     --Output--
     chempy.chemistry.Reaction
+        or Prediction(reaction, energy, exhaustive) with full_output; the
+        reaction is None if the deadline passed before anything balanced
         
     --Examples--
     >>> reaction_predictor(['Al', 'O2'])
     4 Al + 3 O2 → 2 Al2O3
+
+    >>> reaction_predictor(['Al', 'O2'], deadline_ms=500, full_output=True)[1:]
+    (-3164.6, True)
     '''
-    reactants = [state_predictor(r) for r in reactants]
-    possibilities = stoich_filter(reactants)
-    print('scoping possibilities...')
-    if len(possibilities) > max_length:
-        possibilities = np.array(list(possibilities))
-        energies = np.array(
-            [get_gibbs(s, 'G') / get_gibbs(s, 'mass') for s in possibilities])
-        indices = energies.argsort()
-        sorted_possibilities = possibilities[indices]
-        possibilities = sorted_possibilities[:(max_length)]
-
-    print('  optimizing combinations...')
-    combinations = []
-    print(possibilities)
-    comb_length = min(6, len(reactants) + 3)
-    for i in range(1, comb_length):
-        combinations += list(itertools.combinations(possibilities, i))
-    combinations = [c for c in combinations if Z_unique(
-        c) == Z_unique(reactants)]
-    print(combinations)
-
-    print('    deriving equations...')
-    good_combinations = []
-    for i, comb in enumerate(combinations):
-        if check_coefficients(reactants, comb):
-            good_combinations.append(comb)
-
-    print('      calculating energies...')
-    energies = []
-    for gc in good_combinations:
-        energies.append(standard_gibbs_free_energy(reactants, gc))
-
-    best_energy = min(energies)
-    best_index = energies.index(best_energy)
-    best_reaction = Reaction(*balance_stoichiometry(
-        reactants, good_combinations[best_index]))
-
-    print(best_reaction)
-    print(f'delG = {best_energy:.4} kJ mol-1')
-
-    return best_reaction
+    for event in prediction_events(
+            reactants, max_length, cache, deadline_ms, T, context):
+        if callback is not None:
+            callback(event)
+    prediction = Prediction(
+        event['reaction'], event['energy'], event['exhaustive'])
+    if full_output:
+        return prediction
+    if prediction.reaction is None:
+        if not prediction.exhaustive:
+            raise TimeoutError(
+                f'no balanced reaction found for {reactants} in {deadline_ms} ms')
+        raise ValueError(f'no balanced reaction found for {reactants}')
+    return prediction.reaction
+
+
+def screen_reactions(reactants, max_length=12, T=None, context=None):
+    '''
+    Scores every balanced reaction reaction_predictor considers, not only
+    the winner: the same search as prediction_events, run to the end. delG,
+    delH and delS come from one sparse product of each batch's coefficients
+    with the thermo table, and log K = -delG / (R T ln 10).
+
+    --Parameters--
+    reactants:      iterable (str)
+        any iterable containing strings with valid chemical formulas
+    T:              float or None
+        temperature in K; None uses the standard-state columns, at
+        STANDARD_T
+
+    --Output--
+    DataFrame
+        one row per balanced reaction, lowest delG first: reaction,
+        products, delG and delH (kJ mol-1), delS (J mol-1 K-1), log_K,
+        spontaneous (delG < 0) and T
+
+    --Examples--
+    >>> screen_reactions(['Al', 'O2'])[['reaction', 'delG', 'log_K']]
+                              reaction    delG       log_K
+    0  4 Al(s) + 3 O2(g) -> 2 Al2O3(s) -3164.6  554.413933
+    '''
+    import pandas as pd
+    context = _context(context)
+    reactants = tuple(state_predictor(r, T, context) for r in reactants)
+    products, energies = [], []
+    for event in _search(context, reactants, max_length, T, 'GHS'):
+        if event['stage'] == 'batch':
+            products += event['products']
+            energies.append(event['energies'])
+
+    if not products:
+        return pd.DataFrame(columns=SCREEN_COLUMNS)
+    delG, delH, delS = np.concatenate(energies).T
+    temperature = STANDARD_T if T is None else float(T)
+    table = pd.DataFrame({
+        'reaction': [str(_reaction(reactants, p, _coefficients(reactants, p)))
+                     for p in products],
+        'products': [' + '.join(p) for p in products],
+        'delG': delG / 1000,
+        'delH': delH / 1000,
+        'delS': delS,
+        'log_K': -delG / (GAS_CONSTANT * temperature * np.log(10)),
+        'spontaneous': delG < 0,
+        'T': temperature}, columns=SCREEN_COLUMNS)
+    return table.sort_values('delG', kind='stable').reset_index(drop=True)
+
+
+metrics.register_cache('state_predictor', _state)
+for f in (_thermo_index, _element_rows, _elements, _balance, _coefficients,
+          _thermo_at):
+    metrics.register_cache(f.__name__.lstrip('_'), f)
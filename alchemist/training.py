@@ -0,0 +1,438 @@
+'''
+word2vec training over streamed paragraph shards
+
+notebook 01 tokenized every textbook into one in-memory list before training.
+here alchemist.text tokenizes each book once into a shard file, and
+ShardCorpus streams the shards from disk on every pass, so the corpus can
+outgrow memory. training runs one epoch at a time across worker threads and
+checkpoints after each one, so an interrupted run resumes where it stopped.
+
+models are published as versioned artifacts, each recording the shards it
+has seen. when books are added, update trains the current model on the new
+shards only, checks that the classifier still agrees with the previous
+version, and publishes the result; the app picks up a new CURRENT version
+without a restart.
+
+command line:
+    python -m alchemist.text ../data/external/texts/*.pdf -o ./data/interim/shards/
+    python -m alchemist.training train ./data/interim/shards/
+    python -m alchemist.training update ./data/interim/shards/ \
+        --problems ./data/processed/textbook-problems.csv --min-agreement 0.9
+'''
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+
+from alchemist.files import atomic_write
+
+SHARD_DIR = './data/interim/shards/'
+# one directory per published version, plus the CURRENT pointer
+MODEL_DIR = './models/word2vec/'
+CURRENT = 'CURRENT'
+MODEL_FILE = 'word2vec.model'
+VECTORS_FILE = 'vectors.kv'
+META_FILE = 'meta.json'
+# the notebook 01 model: Word2Vec(size=100, window=5, min_count=5,
+# negative=5, iter=20, sg=1)
+PARAMS = {'vector_size': 100, 'window': 5, 'min_count': 5, 'negative': 5,
+          'sg': 1}
+EPOCHS = 20
+
+
+def shard_hashes(shard_dir=SHARD_DIR):
+    '''
+    --Output--
+    list (str)
+        content hashes of every book sharded in shard_dir
+    '''
+    return [os.path.basename(p)[:-len('.txt')] for p in shard_paths(shard_dir)]
+
+
+def shard_paths(shard_dir=SHARD_DIR, hashes=None):
+    '''
+    --Parameters--
+    hashes:         iterable (str) or None
+        content hashes of the books to include; None includes every shard
+
+    --Output--
+    list (str)
+        shard files in a stable order
+    '''
+    if hashes is None:
+        return sorted(glob.glob(os.path.join(shard_dir, '*.txt')))
+    return [os.path.join(shard_dir, f'{h}.txt') for h in sorted(hashes)]
+
+
+class ShardCorpus:
+    '''
+    Restartable stream of tokenized paragraphs, one list of tokens per shard
+    line. gensim iterates it once to build the vocabulary and once per epoch;
+    only the line being read is held in memory.
+    '''
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+
+    def __iter__(self):
+        for path in self.paths:
+            with open(path, encoding='utf-8') as fh:
+                for line in fh:
+                    tokens = line.split()
+                    if tokens:
+                        yield tokens
+
+
+def _checkpoints(checkpoint_dir):
+    # (epochs done, path) of every checkpoint, oldest first
+    found = []
+    for path in glob.glob(os.path.join(checkpoint_dir, 'epoch-*.model')):
+        match = re.search(r'epoch-(\d+)\.model$', path)
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def train_epochs(model, corpus, epochs, done=0, checkpoint_dir=None,
+                 out=sys.stdout):
+    '''
+    Trains model for epochs - done more passes over corpus, decaying the
+    learning rate as one uninterrupted run of epochs passes would, and saves
+    a checkpoint after each one.
+
+    --Parameters--
+    corpus:         iterable (list (str))
+        restartable, e.g. a ShardCorpus
+    done:           int
+        epochs already trained, when resuming
+    '''
+    alpha, min_alpha = model.alpha, model.min_alpha
+    for epoch in range(done, epochs):
+        model.train(corpus, total_examples=model.corpus_count, epochs=1,
+                    start_alpha=alpha - (alpha - min_alpha) * epoch / epochs,
+                    end_alpha=alpha - (alpha - min_alpha) * (epoch + 1) / epochs)
+        print(f'epoch {epoch + 1}/{epochs}', file=out)
+        if checkpoint_dir is not None:
+            model.save(os.path.join(checkpoint_dir,
+                                    f'epoch-{epoch + 1:03d}.model'))
+            # keep just the latest two
+            for _, path in _checkpoints(checkpoint_dir)[:-2]:
+                os.remove(path)
+    model.epochs = epochs
+    return model
+
+
+def train_word2vec(shard_dir=SHARD_DIR, path=None, epochs=EPOCHS,
+                   workers=None, checkpoint_dir=None, out=sys.stdout,
+                   **params):
+    '''
+    Trains a Word2Vec model on every shard in shard_dir, streaming them from
+    disk, and saves it to path if one is given.
+
+    --Parameters--
+    workers:        int or None
+        training threads; None uses every core
+    checkpoint_dir: str or None
+        save after every epoch, and resume from the latest checkpoint found
+        here; use a fresh directory whenever the shards change
+    params:
+        Word2Vec arguments overriding PARAMS
+
+    --Output--
+    gensim.models.Word2Vec
+    '''
+    from gensim.models import Word2Vec
+
+    corpus = ShardCorpus(shard_paths(shard_dir))
+    done = 0
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        checkpoints = _checkpoints(checkpoint_dir)
+        if checkpoints:
+            done, latest = checkpoints[-1]
+            print(f'resuming from {latest}', file=out)
+    if done:
+        model = Word2Vec.load(latest)
+    else:
+        model = Word2Vec(workers=workers or multiprocessing.cpu_count(),
+                         **{**PARAMS, **params})
+        model.build_vocab(corpus)
+    train_epochs(model, corpus, epochs, done, checkpoint_dir, out)
+
+    if path is not None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        model.save(path)
+    return model
+
+
+def publish(model, shards, model_dir=MODEL_DIR, parent=None, quality=None):
+    '''
+    Writes model as a new version in model_dir and makes it CURRENT. The
+    full model is kept for later updates, and its vectors separately so
+    servers can memory-map them.
+
+    --Parameters--
+    shards:         iterable (str)
+        content hashes of every book the model has been trained on
+    parent:         str or None
+        version the model was updated from
+    quality:        dict or None
+        result of the check that accepted it
+
+    --Output--
+    str
+        the new version
+    '''
+    version = time.strftime('%Y%m%d-%H%M%S')
+    while os.path.exists(os.path.join(model_dir, version)):
+        time.sleep(1)
+        version = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(model_dir, version)
+    os.makedirs(path)
+    model.save(os.path.join(path, MODEL_FILE))
+    model.wv.save(os.path.join(path, VECTORS_FILE))
+    with open(os.path.join(path, META_FILE), 'w') as fh:
+        json.dump({'version': version, 'parent': parent,
+                   'shards': sorted(shards), 'vocabulary': len(model.wv),
+                   'quality': quality}, fh, indent=2)
+
+    # swap the pointer last, so readers never see a half-written version
+    with atomic_write(os.path.join(model_dir, CURRENT), 'w') as fh:
+        fh.write(version)
+    return version
+
+
+def current_version(model_dir=MODEL_DIR):
+    '''
+    --Output--
+    str or None
+        the CURRENT version, None if nothing is published yet
+    '''
+    try:
+        with open(os.path.join(model_dir, CURRENT)) as fh:
+            return fh.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def version_meta(version, model_dir=MODEL_DIR):
+    with open(os.path.join(model_dir, version, META_FILE)) as fh:
+        return json.load(fh)
+
+
+def load_vectors(version=None, model_dir=MODEL_DIR):
+    '''
+    --Output--
+    gensim.models.KeyedVectors
+        of version (CURRENT by default), memory-mapped read-only
+    '''
+    from gensim.models import KeyedVectors
+    version = version or current_version(model_dir)
+    return KeyedVectors.load(
+        os.path.join(model_dir, version, VECTORS_FILE), mmap='r')
+
+
+class CurrentVectors:
+    '''
+    The vectors of the CURRENT version, reloaded whenever another version is
+    published. Checking costs one small file read, at most every `every`
+    seconds. Safe to share between threads: one thread reloads while the
+    others keep getting the vectors they had. If CURRENT goes missing or
+    its version cannot be loaded, the loaded vectors keep being served.
+    '''
+
+    def __init__(self, model_dir=MODEL_DIR, every=5):
+        self.model_dir = model_dir
+        self.every = every
+        self.version = None
+        self.vectors = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        vectors = self.vectors
+        if vectors is not None and now - self._checked <= self.every:
+            return vectors
+        if not self._lock.acquire(blocking=vectors is None):
+            return vectors
+        try:
+            if self.vectors is None or now - self._checked > self.every:
+                self._reload()
+                self._checked = now
+            return self.vectors
+        finally:
+            self._lock.release()
+
+    def _reload(self):
+        # a missing, half-written or unloadable version keeps the vectors
+        # already served; the next check after `every` seconds tries again
+        try:
+            version = current_version(self.model_dir)
+            if not version or version == self.version:
+                if self.vectors is None:
+                    raise FileNotFoundError(
+                        f'no published vectors in {self.model_dir}')
+                return
+            vectors = load_vectors(version, self.model_dir)
+        except Exception:
+            if self.vectors is None:
+                raise
+            return
+        self.vectors, self.version = vectors, version
+
+
+def classify(vectors, text):
+    '''
+    The app's classifier, shared by the /classifier route and the agreement
+    check: True when text sits closer to 'balanced equation' than to
+    'electron configuration'. Tokens are nltk's word_tokenize, case
+    preserved, and go to n_similarity as they are, so words missing from
+    the vocabulary are handled as the app handles them (gensim 3 raises
+    KeyError, gensim 4 leaves them out); text without tokens raises
+    ZeroDivisionError.
+
+    --Parameters--
+    vectors:        gensim.models.KeyedVectors
+    text:           str
+
+    --Output--
+    bool
+    '''
+    from nltk.tokenize import word_tokenize
+    tokens = word_tokenize(text)
+    score = vectors.n_similarity(tokens, word_tokenize('balanced equation'))
+    score -= vectors.n_similarity(
+        tokens, word_tokenize('electron configuration'))
+    return bool(score > 0)
+
+
+def agreement(before, after, problems):
+    '''
+    Compares what the app's classifier serves under two sets of vectors. A
+    problem on which classify raises under one version counts as a
+    disagreement unless it raises under the other too.
+
+    --Parameters--
+    before:         gensim.models.KeyedVectors
+    after:          gensim.models.KeyedVectors
+    problems:       iterable (str)
+        problem texts, e.g. the 'text' column of textbook-problems.csv
+
+    --Output--
+    dict
+        compared (int), problems at least one version classifies;
+        unclassified (int), problems neither does; agreement (fraction of
+        compared answered the same way)
+    '''
+    def outcome(vectors, text):
+        try:
+            return classify(vectors, text)
+        except (KeyError, ZeroDivisionError):
+            return None
+
+    compared = same = unclassified = 0
+    for text in problems:
+        a, b = outcome(before, text), outcome(after, text)
+        if a is None and b is None:
+            unclassified += 1
+            continue
+        compared += 1
+        same += a == b
+    return {'compared': compared, 'unclassified': unclassified,
+            'agreement': same / compared if compared else None}
+
+
+def update_word2vec(shard_dir=SHARD_DIR, model_dir=MODEL_DIR, epochs=None,
+                    problems=None, min_agreement=None, out=sys.stdout):
+    '''
+    Extends the CURRENT model's vocabulary with the books sharded since it
+    was trained, trains on those shards only, and publishes the result.
+
+    --Parameters--
+    epochs:         int or None
+        passes over the new shards; None uses the model's own setting
+    problems:       iterable (str) or None
+        texts for the agreement check against the previous version
+    min_agreement:  float or None
+        refuse to publish below this agreement
+
+    --Output--
+    str
+        the CURRENT version afterwards
+    '''
+    from gensim.models import Word2Vec
+
+    parent = current_version(model_dir)
+    if parent is None:
+        raise FileNotFoundError(f'no published model in {model_dir}')
+    meta = version_meta(parent, model_dir)
+    new = sorted(set(shard_hashes(shard_dir)) - set(meta['shards']))
+    if not new:
+        print(f'{parent} is up to date', file=out)
+        return parent
+
+    model = Word2Vec.load(os.path.join(model_dir, parent, MODEL_FILE))
+    corpus = ShardCorpus(shard_paths(shard_dir, new))
+    model.build_vocab(corpus, update=True)
+    model.train(corpus, total_examples=model.corpus_count,
+                epochs=epochs or model.epochs)
+    print(f'trained on {len(new)} new books', file=out)
+
+    quality = None
+    if problems is not None:
+        quality = agreement(load_vectors(parent, model_dir), model.wv,
+                            list(problems))
+        print(f"agreement with {parent}: {quality['agreement']} "
+              f"over {quality['compared']} problems", file=out)
+        if min_agreement is not None and \
+                (quality['agreement'] or 0) < min_agreement:
+            print('not published', file=out)
+            return parent
+    return publish(model, meta['shards'] + new, model_dir, parent, quality)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='train word vectors on tokenized textbook shards')
+    commands = parser.add_subparsers(dest='command', required=True)
+    train = commands.add_parser('train', help='train and publish from scratch')
+    train.add_argument('shard_dir', nargs='?', default=SHARD_DIR)
+    train.add_argument('--model-dir', default=MODEL_DIR)
+    train.add_argument('--epochs', type=int, default=EPOCHS)
+    train.add_argument('-w', '--workers', type=int, default=None)
+    train.add_argument('--checkpoints', default=None,
+                       help='directory for per-epoch checkpoints')
+    update = commands.add_parser(
+        'update', help='train the current version on new shards only')
+    update.add_argument('shard_dir', nargs='?', default=SHARD_DIR)
+    update.add_argument('--model-dir', default=MODEL_DIR)
+    update.add_argument('--epochs', type=int, default=None)
+    update.add_argument('--problems', default=None,
+                        help="CSV with a 'text' column for the agreement check")
+    update.add_argument('--min-agreement', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        model = train_word2vec(args.shard_dir, None, args.epochs,
+                               args.workers, args.checkpoints)
+        version = publish(model, shard_hashes(args.shard_dir), args.model_dir)
+    else:
+        problems = None
+        if args.problems:
+            import pandas as pd
+            problems = pd.read_csv(args.problems)['text'].dropna()
+        version = update_word2vec(args.shard_dir, args.model_dir, args.epochs,
+                                  problems, args.min_agreement)
+    print(f'current version: {version}')
+
+
+if __name__ == '__main__':
+    main()
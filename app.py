@@ -1,7 +1,11 @@
 from flask import Flask, render_template, request, g, session
+from flask import Response, jsonify
 
+import os
 import re
 import json
+import time
+import logging
 import requests
 import pickle
 # import folium
@@ -16,19 +20,53 @@ from chempy import Reaction
 from chempy.util import periodic
 
 from gensim.models.doc2vec import Doc2Vec
-from nltk.tokenize import word_tokenize
 
 from alchemist.tools import formula_from_name, reaction_predictor
-
-MODELA = pickle.load(open('./data/processed/model_1324.p', 'rb'))
+from alchemist.jobs import JobQueue, FINISHED
+from alchemist import metrics
+from alchemist import shared
+from alchemist import training
+
+# with an export in place (python -m alchemist.shared), every worker maps the
+# same copy of the tables and word vectors instead of unpickling its own
+if shared.exported():
+    shared.use_shared()
+
+# published models (python -m alchemist.training) are swapped in as soon as
+# a new version becomes CURRENT
+if training.current_version() is not None:
+    VECTORS = training.CurrentVectors()
+elif os.path.exists(os.path.join(shared.SHARED_DIR, shared.VECTORS_FILE)):
+    VECTORS = shared.attach_vectors()
+else:
+    VECTORS = pickle.load(open('./data/processed/model_1324.p', 'rb')).wv
 # MODELZ = pickle.load(open('./data/processed/model_z.p', 'rb'))
 # stoich_df = pd.read_csv('/data/processed/stoich_df.csv')
 # thermo_df = pd.read_csv('/data/processed/thermo_df.csv')
 
 
+def vectors():
+    return VECTORS.get() if isinstance(VECTORS, training.CurrentVectors) \
+        else VECTORS
+
+
+# background workers for predictions too slow to run inside a request
+JOBS = JobQueue(workers=2, budget=60)
+
+
 # create flask app
 app = Flask(__name__)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# log per-stage timings, counters and cache hit rates for every prediction;
+# off unless ALCHEMIST_LOG_METRICS=1, since collecting adds work per request
+app.config['LOG_METRICS'] = os.environ.get('ALCHEMIST_LOG_METRICS') == '1'
+# a logger of their own at INFO, since Flask's stays at WARNING outside debug
+# mode and would drop them
+METRICS_LOG = logging.getLogger('alchemist.metrics')
+if app.config['LOG_METRICS']:
+    METRICS_LOG.setLevel(logging.INFO)
+    if not METRICS_LOG.handlers:
+        METRICS_LOG.addHandler(logging.StreamHandler())
 # secret key to perform certain actions
 app.secret_key = 'sdfgsdgfdgfgfdgd'
 
@@ -49,13 +87,8 @@ def index():
 def classifier():
 
     if request.method == 'POST':
-        bal = 0
         raw_input = request.form['class']
-        bal += MODELA.wv.n_similarity(word_tokenize(raw_input), 
-                                      word_tokenize('balanced equation'))
-        bal -= MODELA.wv.n_similarity(word_tokenize(raw_input),
-                                      word_tokenize('electron configuration'))
-        if bal > 0:
+        if training.classify(vectors(), raw_input):
             processed = cde.doc.Paragraph(raw_input)
             names = [cem.text for cem in processed.cems]
             formulas = [formula_from_name(n) for n in names]
@@ -66,24 +99,92 @@ def classifier():
 
 
 
-# predict the products of a chemical reaction
-@app.route('/transmuter', methods=["POST"])
-def transmuter():
+def transmute(raw_input, callback=None, deadline_ms=None):
+    start = time.perf_counter()
+
+    if not app.config['LOG_METRICS']:
+        return _transmute(raw_input, callback, deadline_ms, start)
+    with metrics.collect() as m:
+        reaction = _transmute(raw_input, callback, deadline_ms, start)
+    METRICS_LOG.info('transmute %r: %s', raw_input, m.to_json())
+    return reaction
 
-    if request.method == 'POST':
 
-        # use CDE to translate names to formulas
-        raw_input = request.form['trans']
+def _transmute(raw_input, callback, deadline_ms, start):
+    # use CDE to translate names to formulas
+    with metrics.timer('stage.names'):
         processed = cde.doc.Paragraph(raw_input)
         names = [cem.text for cem in processed.cems]
         formulas = [formula_from_name(n) for n in names]
 
-        # apply all balancing algos
-        reaction = reaction_predictor(formulas)
+    # apply all balancing algos in whatever time the name lookups left us
+    if deadline_ms is not None:
+        deadline_ms -= (time.perf_counter() - start) * 1000
+    return reaction_predictor(formulas, callback=callback,
+                              deadline_ms=deadline_ms)
 
+
+def event_summary(event):
+    # reactions aren't JSON serializable; jobs report them as text
+    summary = dict(event)
+    if 'reaction' in summary:
+        summary['reaction'] = str(summary['reaction'])
+    return summary
+
+
+# predict the products of a chemical reaction
+@app.route('/transmuter', methods=["POST"])
+def transmuter():
+
+    if request.method == 'POST':
+        reaction = transmute(request.form['trans'])
         return render_template("index.html",reaction=reaction)
 
 
+# same prediction, run in the background; returns a job id to poll
+@app.route('/jobs', methods=["POST"])
+def submit_job():
+    raw_input = request.form['trans']
+    # the queue's deadline stops the search a little before the job's budget
+    # runs out, so it finishes with its best answer and frees its worker
+    job_id = JOBS.submit(
+        lambda callback, deadline_ms: str(transmute(
+            raw_input, callback=lambda e: callback(event_summary(e)),
+            deadline_ms=deadline_ms)),
+        progress=True, deadline=True)
+    return jsonify(JOBS.status(job_id)), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = JOBS.status(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job)
+
+
+# server-sent events, one per state change or progress report (including
+# the best reaction found so far), until the job finishes
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    if JOBS.status(job_id) is None:
+        return jsonify({'error': 'unknown job'}), 404
+
+    def events():
+        last = None
+        while True:
+            job = JOBS.wait(job_id, timeout=1)
+            if job is None:
+                break
+            if job != last:
+                yield f'data: {json.dumps(job)}\n\n'
+                last = job
+            if job['status'] in FINISHED:
+                break
+
+    return Response(events(), mimetype='text/event-stream')
+
+
 
 
 
@@ -14,10 +14,13 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/jydiw/alchemist',
     packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': ['alchemist-predict=alchemist.batch:main'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file
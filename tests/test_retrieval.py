@@ -0,0 +1,46 @@
+import numpy as np
+
+from alchemist.retrieval import ChapterRetriever
+
+
+class FakeModel:
+    '''
+    Stands in for Doc2Vec: the inferred vector depends on the tokens' case.
+    '''
+
+    def __init__(self):
+        self.calls = []
+
+    def infer_vector(self, tokens, epochs=None):
+        self.calls.append(tokens)
+        upper = sum(sum(c.isupper() for c in t) for t in tokens)
+        return np.array([1.0, upper, 0.0])
+
+
+def retriever():
+    index = (np.eye(3, dtype=np.float32), ['a', 'b', 'c'])
+    return ChapterRetriever(FakeModel(), index)
+
+
+def test_case_variants_get_their_own_vectors():
+    r = retriever()
+    upper = r.vector('Balance CH4')
+    lower = r.vector('balance ch4')
+    assert r.model.calls == [['Balance', 'CH4'], ['balance', 'ch4']]
+    assert not np.allclose(upper, lower)
+    assert r.top_k(['Balance CH4'])[0] != r.top_k(['balance ch4'])[0]
+
+
+def test_order_does_not_change_vectors():
+    first, second = retriever(), retriever()
+    a = first.vector('Balance CH4'), first.vector('balance ch4')
+    b = second.vector('balance ch4'), second.vector('Balance CH4')
+    assert np.array_equal(a[0], b[1]) and np.array_equal(a[1], b[0])
+
+
+def test_spacing_shares_an_entry():
+    r = retriever()
+    r.vector('Balance  CH4\n')
+    r.vector('Balance CH4')
+    assert len(r.model.calls) == 1
+    assert (r.hits, r.misses) == (1, 1)